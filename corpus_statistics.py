@@ -0,0 +1,173 @@
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from jsonl_io import iter_jsonl, shard_byte_ranges
+
+CATEGORIES = ("NOMENCLATURE", "TAXON", "ACRONYM", "SITE")
+
+# tokens are whole words; the words either side are read from the word list, so a token is never taken as context
+WORD = re.compile(r'\w+')
+
+TOKEN_WORD = re.compile(r'(NOMENCLATURE|TAXON|ACRONYM|SITE)(\d+)')
+
+NUMBER_BUCKET_SIZE = 100
+TOP_CONTEXTS = 50
+MISMATCH_EXAMPLES = 20
+
+
+def _context_word(word):
+    # a neighbouring token counts as its category, like the token itself
+    match = TOKEN_WORD.fullmatch(word)
+    return match.group(1) if match else word.lower()
+
+
+def scan_tokens(text):
+    # (token, category, number, context) for every token; context is None unless there is a word on both sides
+    words = [(match.start(), match.end(), match.group()) for match in WORD.finditer(text)]
+    found = []
+    for i, (start, end, word) in enumerate(words):
+        match = TOKEN_WORD.fullmatch(word)
+        if match is None:
+            continue
+        category, number = match.groups()
+        # a neighbour only counts when nothing but whitespace separates it from the token
+        before = words[i - 1] if i > 0 and text[words[i - 1][1]:start].isspace() else None
+        after = words[i + 1] if i + 1 < len(words) and text[end:words[i + 1][0]].isspace() else None
+        context = f"{_context_word(before[2])} {category} {_context_word(after[2])}" if before and after else None
+        found.append((word, category, int(number), context))
+    return found
+
+
+class CorpusStatistics:
+    """Token counts, number histograms, contexts and source/target mismatches, mergeable across shards"""
+    
+    def __init__(self):
+        self.records = 0
+        self.records_with_tokens = 0
+        self.source_counts = Counter()
+        self.target_counts = Counter()
+        self.record_counts = Counter()
+        self.number_buckets = {category: Counter() for category in CATEGORIES}
+        self.contexts = Counter()
+        self.mismatched_records = 0
+        self.missing_in_target = Counter()
+        self.missing_in_source = Counter()
+        self.mismatch_examples = []
+    
+    def update(self, record):
+        self.records += 1
+        source_tokens = scan_tokens(record['source'])
+        target_tokens = scan_tokens(record['target'])
+        if not source_tokens and not target_tokens:
+            return
+        
+        self.records_with_tokens += 1
+        for counts, tokens in ((self.source_counts, source_tokens), (self.target_counts, target_tokens)):
+            for _, category, number, context in tokens:
+                counts[category] += 1
+                self.number_buckets[category][number // NUMBER_BUCKET_SIZE * NUMBER_BUCKET_SIZE] += 1
+                if context is not None:
+                    self.contexts[context] += 1
+        self.record_counts.update({category for _, category, _, _ in source_tokens + target_tokens})
+        
+        source_multiset = Counter(token for token, _, _, _ in source_tokens)
+        target_multiset = Counter(token for token, _, _, _ in target_tokens)
+        if source_multiset != target_multiset:
+            self.mismatched_records += 1
+            for token, count in (source_multiset - target_multiset).items():
+                self.missing_in_target[token.rstrip("0123456789")] += count
+            for token, count in (target_multiset - source_multiset).items():
+                self.missing_in_source[token.rstrip("0123456789")] += count
+            if len(self.mismatch_examples) < MISMATCH_EXAMPLES:
+                self.mismatch_examples.append({'source': record['source'], 'target': record['target']})
+    
+    def merge(self, other):
+        self.records += other.records
+        self.records_with_tokens += other.records_with_tokens
+        self.source_counts.update(other.source_counts)
+        self.target_counts.update(other.target_counts)
+        self.record_counts.update(other.record_counts)
+        for category in CATEGORIES:
+            self.number_buckets[category].update(other.number_buckets[category])
+        self.contexts.update(other.contexts)
+        self.mismatched_records += other.mismatched_records
+        self.missing_in_target.update(other.missing_in_target)
+        self.missing_in_source.update(other.missing_in_source)
+        self.mismatch_examples.extend(other.mismatch_examples[:MISMATCH_EXAMPLES - len(self.mismatch_examples)])
+        return self
+    
+    def report(self, top_contexts=TOP_CONTEXTS):
+        contexts_per_category = Counter(context.split(" ")[1] for context in self.contexts)
+        return {
+            'records': self.records,
+            'records_with_tokens': self.records_with_tokens,
+            'categories': {category: {
+                'source_tokens': self.source_counts[category],
+                'target_tokens': self.target_counts[category],
+                'records': self.record_counts[category],
+                'unique_contexts': contexts_per_category[category]
+            } for category in CATEGORIES},
+            'token_numbers': {category: {f"{bucket}-{bucket + NUMBER_BUCKET_SIZE - 1}": count
+                                         for bucket, count in sorted(self.number_buckets[category].items())}
+                              for category in CATEGORIES},
+            'contexts': {
+                'total': sum(self.contexts.values()),
+                'unique': len(self.contexts),
+                'singletons': sum(1 for count in self.contexts.values() if count == 1),
+                'most_common': self.contexts.most_common(top_contexts)
+            },
+            'mismatches': {
+                'records': self.mismatched_records,
+                'missing_in_target': dict(self.missing_in_target),
+                'missing_in_source': dict(self.missing_in_source),
+                'examples': self.mismatch_examples
+            }
+        }
+
+
+def _shard_statistics(shard):
+    input_file, start, end = shard
+    statistics = CorpusStatistics()
+    for record in iter_jsonl(input_file, start, end):
+        statistics.update(record)
+    return statistics
+
+
+def collect_statistics(input_file, num_workers=None):
+    num_workers = num_workers or os.cpu_count() or 1
+    shards = [(input_file, start, end) for start, end in shard_byte_ranges(input_file, num_workers * 4)]
+    
+    statistics = CorpusStatistics()
+    if num_workers == 1:
+        for shard in shards:
+            statistics.merge(_shard_statistics(shard))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            for shard_statistics in executor.map(_shard_statistics, shards):
+                statistics.merge(shard_statistics)
+    return statistics
+
+
+def corpus_statistics(input_file, output_file, num_workers=None, top_contexts=TOP_CONTEXTS):
+    print(f"Collecting token statistics from {input_file}...")
+    report = collect_statistics(input_file, num_workers).report(top_contexts)
+    report['source_file'] = input_file
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    print(f"Records: {report['records']} ({report['records_with_tokens']} with tokens)")
+    for category, counts in report['categories'].items():
+        print(f"{category}: {counts['source_tokens']} source, {counts['target_tokens']} target, "
+              f"{counts['unique_contexts']} unique contexts")
+    print(f"Unique contexts: {report['contexts']['unique']} of {report['contexts']['total']}")
+    print(f"Records with mismatched tokens: {report['mismatches']['records']}")
+    print(f"Saved report to {output_file}")
+    return report
+
+
+if __name__ == "__main__":
+    corpus_statistics("../Data/training_replacements.jsonl", "../Data/training_replacements_statistics.json")
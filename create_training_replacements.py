@@ -1,14 +1,19 @@
+import functools
 import json
+import os
 import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from scipy.stats import pareto
 
+from jsonl_io import JsonlWriter, iter_jsonl, shard_byte_ranges
+from text_processing import TOKEN_PATTERN, TermMatcher
 
-def load_jsonl(file_path):
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data.append(json.loads(line.strip()))
-    return data
+# shard count is fixed rather than tied to the number of workers, so the output does not depend on the machine
+NUM_SHARDS = 64
+SEED = 42
 
 
 def load_translations(file_path):
@@ -29,93 +34,202 @@ def build_term_index(translations):
     return french_to_info, english_to_info
 
 
-def find_translation_matches(source, target, source_lang, french_index, english_index):
-    matches = []
-    
+def build_term_matchers(french_index, english_index):
+    # one case-sensitive automaton per language; values carry each term's position in its index so matches come
+    # out in the same order as walking the index
+    return {
+        'fr': TermMatcher(((term, (position, term)) for position, term in enumerate(french_index)), ignore_case=False),
+        'en': TermMatcher(((term, (position, term)) for position, term in enumerate(english_index)), ignore_case=False)
+    }
+
+
+def find_whole_word_terms(matcher, text):
+    # terms with at least one occurrence that replace_whole_word would replace: preceded by whitespace or the start,
+    # followed by whitespace, .,;:!? or the end
+    found = {}
+    for start, end, (position, term) in matcher.iter_matches(text):
+        if term in found:
+            continue
+        if (start == 0 or text[start - 1].isspace()) and (
+                end == len(text) or text[end].isspace() or text[end] in '.,;:!?'):
+            found[term] = position
+    return found
+
+
+def find_translation_matches(source, target, source_lang, french_index, english_index, matchers):
     if source_lang == 'en':
-        for english_term in english_index:
-            if english_term in source:
-                category, french_term, _ = english_index[english_term]
-                if french_term in target:
-                    matches.append((category, french_term, english_term))
+        source_terms = find_whole_word_terms(matchers['en'], source)
+        target_terms = find_whole_word_terms(matchers['fr'], target)
+        matched = [(position, english_index[english_term]) for english_term, position in source_terms.items()
+                   if english_index[english_term][1] in target_terms]
     else:
-        for french_term in french_index:
-            if french_term in source:
-                category, _, english_term = french_index[french_term]
-                if english_term in target:
-                    matches.append((category, french_term, english_term))
+        source_terms = find_whole_word_terms(matchers['fr'], source)
+        target_terms = find_whole_word_terms(matchers['en'], target)
+        matched = [(position, french_index[french_term]) for french_term, position in source_terms.items()
+                   if french_index[french_term][2] in target_terms]
     
-    return matches
+    return [match for _, match in sorted(matched)]
+
+
+@functools.lru_cache(maxsize=65536)
+def whole_word_pattern(word):
+    return re.compile(r'(?<!\S)' + re.escape(word) + r'(?=\s|[.,;:!?]|$)')
+
+
+@functools.lru_cache(maxsize=65536)
+def whole_word_occurrences(word):
+    # zero-width, so finditer reports overlapping occurrences too
+    return re.compile(r'(?<!\S)(?=' + re.escape(word) + r'(?:\s|[.,;:!?]|$))')
 
 
 def replace_whole_word(text, word, replacement):
-    pattern = r'(?<!\S)' + re.escape(word) + r'(?=\s|[.,;:!?]|$)'
-    return re.sub(pattern, replacement, text)
+    return whole_word_pattern(word).sub(replacement, text)
+
+
+def replace_whole_words(text, replacements):
+    # same result as calling replace_whole_word for each (word, replacement) in turn, but the text is rebuilt once:
+    # earlier replacements win overlaps, and an occurrence right next to an earlier replacement loses its boundary
+    # because replacement tokens are letters and digits
+    if any(TOKEN_PATTERN.search(word) for word, _ in replacements):
+        # a word containing a token could match text that an earlier replacement created
+        for word, replacement in replacements:
+            text = replace_whole_word(text, word, replacement)
+        return text
+    
+    spans = []
+    for priority, (word, replacement) in enumerate(replacements):
+        if not word:
+            continue
+        earlier = len(spans)
+        resume = 0
+        for match in whole_word_occurrences(word).finditer(text):
+            start = match.start()
+            end = start + len(word)
+            if start < resume:
+                continue
+            if any(start <= span_end and span_start <= end for span_start, span_end, _ in spans[:earlier]):
+                continue
+            spans.append((start, end, replacement))
+            resume = end
+    
+    if not spans:
+        return text
+    
+    pieces = []
+    position = 0
+    for start, end, replacement in sorted(spans):
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return ''.join(pieces)
 
 
 def create_replacement_token(category, counter):
     return f"{category.upper()}{counter:04d}"
 
 
-def choose_random_int():
+def choose_random_int(random_state=None):
     max_n = 999
-    n = int(pareto(b=1.16, scale=1).rvs())
+    n = int(pareto(b=1.16, scale=1).rvs(random_state=random_state))
     if n <= max_n:
         return n
-    return choose_random_int()
+    return choose_random_int(random_state)
 
 
-def process_training_data():
-    print("Loading data...")
-    training_data = load_jsonl('../Data/training_data.jsonl')
-    translations = load_translations('../Data/preferential_translations.json')
+def process_entry(entry, french_index, english_index, matchers, random_state=None):
+    source = entry['source']
+    target = entry['target']
+    source_lang = entry['source_lang']
     
-    print("Building indexes...")
-    french_index, english_index = build_term_index(translations)
+    matches = find_translation_matches(source, target, source_lang, french_index, english_index, matchers)
+    if not matches:
+        return None
     
-    print(f"Processing {len(training_data)} entries...")
-    results = []
+    replacements = []
+    local_counters = {}
     
-    for i, entry in enumerate(training_data):
-        if i % 5000 == 0:
-            print(f"Processed {i}/{len(training_data)}")
-        
-        source = entry['source']
-        target = entry['target']
-        source_lang = entry['source_lang']
+    for category, french_term, english_term in matches:
+        if category not in local_counters:
+            local_counters[category] = choose_random_int(random_state)
+        else:
+            local_counters[category] += 1
         
-        matches = find_translation_matches(source, target, source_lang, french_index, english_index)
+        replacement_token = create_replacement_token(category, local_counters[category])
         
-        if matches:
-            new_source = source
-            new_target = target
-            local_counters = {}
-            
-            for category, french_term, english_term in matches:
-                if category not in local_counters:
-                    local_counters[category] = choose_random_int()
-                else:
-                    local_counters[category] += 1
-                
-                replacement_token = create_replacement_token(category, local_counters[category])
-                
-                new_source = replace_whole_word(new_source, french_term, replacement_token)
-                new_source = replace_whole_word(new_source, english_term, replacement_token)
-                new_target = replace_whole_word(new_target, french_term, replacement_token)
-                new_target = replace_whole_word(new_target, english_term, replacement_token)
-            
-            results.append({
-                'source': new_source,
-                'target': new_target,
-                'source_lang': source_lang
-            })
-    
-    print(f"Writing {len(results)} results to training_replacements.jsonl...")
-    with open('../Data/training_replacements.jsonl', 'w', encoding='utf-8') as f:
-        for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + '\n')
-    
-    print(f"Completed! Found {len(results)} entries with valid translation matches")
+        replacements.append((french_term, replacement_token))
+        replacements.append((english_term, replacement_token))
+    
+    return {
+        'source': replace_whole_words(source, replacements),
+        'target': replace_whole_words(target, replacements),
+        'source_lang': source_lang
+    }
+
+
+_worker_indexes = None
+
+
+def _init_worker(translations):
+    global _worker_indexes
+    french_index, english_index = build_term_index(translations)
+    _worker_indexes = french_index, english_index, build_term_matchers(french_index, english_index)
+
+
+def _process_shard(shard):
+    shard_index, training_file, start, end, output_file, seed = shard
+    french_index, english_index, matchers = _worker_indexes
+    # every shard gets its own generator, so the tokens drawn do not depend on which worker runs it or when
+    random_state = np.random.default_rng([seed, shard_index])
+    
+    entries = 0
+    with JsonlWriter(output_file) as writer:
+        for entry in iter_jsonl(training_file, start, end):
+            entries += 1
+            result = process_entry(entry, french_index, english_index, matchers, random_state)
+            if result is not None:
+                writer.write(result)
+    return shard_index, entries, writer.count
+
+
+def process_training_data(training_file='../Data/training_data.jsonl',
+                          translations_file='../Data/preferential_translations.json',
+                          output_file='../Data/training_replacements.jsonl',
+                          num_workers=None, num_shards=NUM_SHARDS, seed=SEED):
+    translations = load_translations(translations_file)
+    num_workers = num_workers or os.cpu_count() or 1
+    
+    shard_files = [f"{output_file}.shard{i:04d}" for i in range(num_shards)]
+    shards = [(i, training_file, start, end, shard_files[i], seed)
+              for i, (start, end) in enumerate(shard_byte_ranges(training_file, num_shards))]
+    
+    print(f"Processing {training_file} in {num_shards} shards on {num_workers} workers...")
+    total_entries = 0
+    total_written = 0
+    if num_workers == 1:
+        _init_worker(translations)
+        shard_results = map(_process_shard, shards)
+    else:
+        executor = ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(translations,))
+        shard_results = executor.map(_process_shard, shards)
+    
+    try:
+        for shard_index, entries, written in shard_results:
+            total_entries += entries
+            total_written += written
+            print(f"Shard {shard_index + 1}/{num_shards}: {entries} entries, {written} with matches")
+    finally:
+        if num_workers != 1:
+            executor.shutdown()
+    
+    print(f"Merging shards into {output_file}...")
+    with open(output_file, 'wb') as out:
+        for shard_file in shard_files:
+            with open(shard_file, 'rb') as f:
+                shutil.copyfileobj(f, out)
+            os.remove(shard_file)
+    
+    print(f"Completed! Found {total_written} of {total_entries} entries with valid translation matches")
 
 
 if __name__ == "__main__":
@@ -1,8 +1,26 @@
+import hashlib
 import json
+import numpy as np
 import pandas as pd
 import os
 import openpyxl
+import posixpath
+import zipfile
 from datetime import datetime
+from openpyxl.utils.cell import range_boundaries
+from xml.etree import ElementTree
+
+from terminology_binary import write_terminology_binary
+
+SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIP_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELATIONSHIP_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+PLACE_NAMES_CSV = 'reference/vw_Place_Names_Noms_Lieux_APCA_V2_FGP.csv'
+PLACE_NAMES_CHUNK_SIZE = 100000
+
+# bump when extraction changes, so old manifests stop matching and everything is rebuilt
+MANIFEST_VERSION = 1
 
 
 def save_json(data, file_path):
@@ -10,133 +28,285 @@ def save_json(data, file_path):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def _clean_column(df, column):
+    # str(value).strip() for every present cell and '' for missing ones, so a missing column behaves like empty cells
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    values = df[column]
+    present = values.notna()
+    cleaned = pd.Series('', index=df.index, dtype=object)
+    cleaned[present] = values[present].map(str).str.strip()
+    return cleaned
+
+
+def _pairs_to_dict(*pairs):
+    # each pair is (keys, values, mask) over the same rows; rows are taken in order and pairs in order within a row,
+    # the same as assigning them one at a time, so a later duplicate key still overwrites an earlier one
+    frames = []
+    for pair_number, (keys, values, mask) in enumerate(pairs):
+        mask = mask.to_numpy()
+        frames.append(pd.DataFrame({
+            'row': np.flatnonzero(mask),
+            'pair': pair_number,
+            'key': keys.to_numpy()[mask],
+            'value': values.to_numpy()[mask]
+        }))
+    combined = pd.concat(frames, ignore_index=True).sort_values(['row', 'pair'], kind='stable')
+    return dict(zip(combined['key'], combined['value']))
+
+
 def extract_technical_terms(file_path):
     df = pd.read_excel(file_path, sheet_name="Technical Terms")
     
-    translations = {}
+    en_term = _clean_column(df, 'Term (E)')
+    fr_term = _clean_column(df, 'Term (F)')
+    alt_fr = _clean_column(df, 'Alternate (F)')
     
-    for _, row in df.iterrows():
-        en_term = row.get('Term (E)')
-        fr_term = row.get('Term (F)')
-        alt_fr = row.get('Alternate (F)')
-        
-        if pd.notna(en_term) and pd.notna(fr_term):
-            en_clean = str(en_term).strip()
-            fr_clean = str(fr_term).strip()
-            
-            if en_clean and fr_clean:
-                translations[fr_clean] = en_clean
-                
-                if pd.notna(alt_fr):
-                    alt_clean = str(alt_fr).strip()
-                    if alt_clean:
-                        translations[alt_clean] = en_clean
-    
-    return translations
+    has_term = (en_term != '') & (fr_term != '')
+    return _pairs_to_dict((fr_term, en_term, has_term),
+                          (alt_fr, en_term, has_term & (alt_fr != '')))
 
 
 def extract_species_names(file_path):
     df = pd.read_excel(file_path, sheet_name="Species Names")
     
-    translations = {}
+    en_species = _clean_column(df, 'Species Name (E)')
+    fr_species = _clean_column(df, 'Species Name (F)')
     
-    for _, row in df.iterrows():
-        en_species = row.get('Species Name (E)')
-        fr_species = row.get('Species Name (F)')
-        
-        if pd.notna(en_species) and pd.notna(fr_species):
-            en_clean = str(en_species).strip()
-            fr_clean = str(fr_species).strip()
-            
-            if en_clean and fr_clean:
-                translations[fr_clean] = en_clean
-    
-    return translations
+    return _pairs_to_dict((fr_species, en_species, (en_species != '') & (fr_species != '')))
 
 
 def extract_acronyms_abbreviations(file_path):
     df = pd.read_excel(file_path, sheet_name="Aconyms & Abbreviations")
     
-    translations = {}
+    en_acronym = _clean_column(df, 'Acronym/\nAbbreviation (E) ')
+    fr_acronym = _clean_column(df, 'Acronym/\nAbbreviation (F) ')
+    en_full = _clean_column(df, 'Full Name/\nMeaning (E)')
+    fr_full = _clean_column(df, 'Full Name/\nMeaning (F)')
     
-    for _, row in df.iterrows():
-        en_acronym = row.get('Acronym/\nAbbreviation (E) ')
-        fr_acronym = row.get('Acronym/\nAbbreviation (F) ')
-        en_full = row.get('Full Name/\nMeaning (E)')
-        fr_full = row.get('Full Name/\nMeaning (F)')
-        
-        if pd.notna(en_acronym) and pd.notna(fr_acronym):
-            en_clean = str(en_acronym).strip()
-            fr_clean = str(fr_acronym).strip()
-            if en_clean and fr_clean:
-                translations[fr_clean] = en_clean
-        
-        if pd.notna(en_full) and pd.notna(fr_full):
-            en_full_clean = str(en_full).strip()
-            fr_full_clean = str(fr_full).strip()
-            if en_full_clean and fr_full_clean:
-                translations[fr_full_clean] = en_full_clean
-    
-    return translations
+    return _pairs_to_dict((fr_acronym, en_acronym, (en_acronym != '') & (fr_acronym != '')),
+                          (fr_full, en_full, (en_full != '') & (fr_full != '')))
 
 
-def extract_place_names():
+def _extract_place_names(csv_file, chunksize):
+    # (place translations, whether the whole file was read); a partial result is still returned after a warning
     place_translations = {}
-    
-    csv_file = 'reference/vw_Place_Names_Noms_Lieux_APCA_V2_FGP.csv'
+    conflicts = {}  # French name -> the distinct English names it was given
+    complete = False
     
     if os.path.exists(csv_file):
         try:
-            df = pd.read_csv(csv_file)
-            
-            for _, row in df.iterrows():
-                name_en = row.get('Name_e')
-                name_fr = row.get('Nom_f')
+            # only the two name columns, as strings, a chunk at a time so memory stays flat as the gazetteer grows
+            for chunk in pd.read_csv(csv_file, usecols=['Name_e', 'Nom_f'], dtype=str, chunksize=chunksize):
+                name_en = _clean_column(chunk, 'Name_e')
+                name_fr = _clean_column(chunk, 'Nom_f')
+                keep = (name_en != name_fr) & (name_en != '') & (name_fr != '')
+                pairs = pd.DataFrame({'fr': name_fr[keep], 'en': name_en[keep]}).drop_duplicates()
+                
+                previous = [place_translations.get(fr) for fr in pairs['fr']]
+                clashing = pairs['fr'].duplicated(keep=False).to_numpy() | np.array(
+                    [prev is not None and prev != en for prev, en in zip(previous, pairs['en'])], dtype=bool)
+                for fr, en in zip(pairs['fr'][clashing], pairs['en'][clashing]):
+                    names = conflicts.setdefault(fr, [place_translations[fr]] if fr in place_translations else [])
+                    if en not in names:
+                        names.append(en)
                 
-                if pd.notna(name_en) and pd.notna(name_fr):
-                    name_en_clean = str(name_en).strip()
-                    name_fr_clean = str(name_fr).strip()
-                    
-                    if name_en_clean != name_fr_clean and name_en_clean and name_fr_clean:
-                        place_translations[name_fr_clean] = name_en_clean
+                # the last English name for a French name wins, at the position where the French name first appeared
+                latest = pd.Series(name_en[keep].to_numpy(), index=name_fr[keep].to_numpy())
+                latest = latest[~latest.index.duplicated(keep='last')]
+                first_seen = name_fr[keep].drop_duplicates().to_numpy()
+                place_translations.update(zip(first_seen, latest[first_seen].to_numpy()))
+            complete = True
         
         except Exception as e:
             print(f"Warning: Could not process {csv_file}: {e}")
     else:
         print(f"Warning: {csv_file} not found")
     
+    if conflicts:
+        print(f"Warning: {len(conflicts)} French place names have more than one English name, keeping the last one:")
+        for fr, names in list(conflicts.items())[:10]:
+            print(f"  {fr}: {' | '.join(names)}")
+        if len(conflicts) > 10:
+            print(f"  ... and {len(conflicts) - 10} more")
+    
+    return place_translations, complete
+
+
+def extract_place_names(csv_file=PLACE_NAMES_CSV, chunksize=PLACE_NAMES_CHUNK_SIZE):
+    place_translations, _ = _extract_place_names(csv_file, chunksize)
     return place_translations
 
 
+def _resolve_part(base_dir, target):
+    # relationship targets are relative to the source part's directory, or to the package root when they start with /
+    if target.startswith("/"):
+        return posixpath.normpath(target.lstrip("/"))
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _sheet_part(archive, sheet_name):
+    # path of a sheet's XML inside the xlsx archive, via the workbook's relationships
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    relationship_id = None
+    for sheet in workbook.iter(f"{{{SPREADSHEET_NS}}}sheet"):
+        if sheet.get("name") == sheet_name:
+            relationship_id = sheet.get(f"{{{RELATIONSHIP_NS}}}id")
+    if relationship_id is None:
+        raise KeyError(f"Worksheet {sheet_name} does not exist.")
+    
+    relationships = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for relationship in relationships.iter(f"{{{PACKAGE_RELATIONSHIP_NS}}}Relationship"):
+        if relationship.get("Id") == relationship_id:
+            return _resolve_part("xl", relationship.get("Target"))
+    raise KeyError(f"Worksheet {sheet_name} has no part in the workbook.")
+
+
+def _sheet_hyperlinks(archive, sheet_part):
+    # (row, column, target) for every hyperlinked cell, in sheet order; targets live in the sheet's .rels part
+    rels_part = posixpath.join(posixpath.dirname(sheet_part), "_rels", posixpath.basename(sheet_part) + ".rels")
+    targets = {}
+    if rels_part in archive.namelist():
+        for relationship in ElementTree.fromstring(archive.read(rels_part)).iter(
+                f"{{{PACKAGE_RELATIONSHIP_NS}}}Relationship"):
+            targets[relationship.get("Id")] = relationship.get("Target")
+    
+    links = {}
+    for _, element in ElementTree.iterparse(archive.open(sheet_part)):
+        if element.tag == f"{{{SPREADSHEET_NS}}}hyperlink":
+            target = targets.get(element.get(f"{{{RELATIONSHIP_NS}}}id"))
+            min_column, min_row, max_column, max_row = range_boundaries(element.get("ref"))
+            for row in range(min_row, max_row + 1):
+                for column in range(min_column, max_column + 1):
+                    links[(row, column)] = target
+        element.clear()
+    return [(row, column, target) for (row, column), target in sorted(links.items())]
+
+
 def get_place_names_sources(file_path):
+    # read-only openpyxl does not load hyperlinks, so they come straight from the sheet XML and only the linked
+    # cells' values are read from the workbook
     try:
-        wb = openpyxl.load_workbook(file_path)
-        ws = wb["Place Names"]
+        with zipfile.ZipFile(file_path) as archive:
+            hyperlinks = _sheet_hyperlinks(archive, _sheet_part(archive, "Place Names"))
+        if not hyperlinks:
+            return []
         
-        links = []
-        for row in ws.iter_rows():
-            for cell in row:
-                if cell.hyperlink:
-                    links.append({
-                        'url': cell.hyperlink.target,
-                        'description': cell.value
-                    })
+        wb = openpyxl.load_workbook(file_path, read_only=True)
+        try:
+            ws = wb["Place Names"]
+            last_row = max(row for row, _, _ in hyperlinks)
+            last_column = max(column for _, column, _ in hyperlinks)
+            values = {}
+            for row in ws.iter_rows(min_row=1, max_row=last_row, max_col=last_column):
+                for cell in row:
+                    if hasattr(cell, "column"):
+                        values[(cell.row, cell.column)] = cell.value
+        finally:
+            wb.close()
         
-        return links
+        return [{'url': target, 'description': values.get((row, column))} for row, column, target in hyperlinks]
     except Exception as e:
         print(f"Warning: Could not extract place names sources: {e}")
         return []
 
 
-def generate_all_translations(spreadsheet_file="translations_spreadsheet.xlsx", output_file="../Data/preferential_translations.json"):
+def file_fingerprint(file_path):
+    if not os.path.exists(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sheet_fingerprints(file_path, sheet_names):
+    # hashes of each sheet's cell values, so a save that only touches another sheet (or formatting) is not a change
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        fingerprints = {}
+        for sheet_name in sheet_names:
+            digest = hashlib.sha256()
+            if sheet_name in wb.sheetnames:
+                for row in wb[sheet_name].iter_rows(values_only=True):
+                    digest.update(json.dumps(row, default=str, ensure_ascii=False).encode('utf-8'))
+                    digest.update(b'\n')
+            fingerprints[sheet_name] = digest.hexdigest()
+        return fingerprints
+    finally:
+        wb.close()
+
+
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+SHEET_CATEGORIES = {
+    'nomenclature': ("Technical Terms", extract_technical_terms),
+    'taxon': ("Species Names", extract_species_names),
+    'acronym': ("Aconyms & Abbreviations", extract_acronyms_abbreviations),
+}
+
+
+def generate_all_translations(spreadsheet_file="translations_spreadsheet.xlsx", output_file="../Data/preferential_translations.json",
+                              binary_output_file="../Data/preferential_translations.bin", manifest_file=None, force=False):
     print(f"Generating translation dictionaries from {spreadsheet_file}...")
     print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    technical_terms = extract_technical_terms(spreadsheet_file)
-    species_names = extract_species_names(spreadsheet_file)
-    acronyms_abbreviations = extract_acronyms_abbreviations(spreadsheet_file)
-    place_names = extract_place_names()
-    place_names_sources = get_place_names_sources(spreadsheet_file)
+    # the manifest records what each category was built from; a category is only re-extracted when that changed
+    manifest_file = manifest_file or os.path.splitext(output_file)[0] + '.manifest.json'
+    manifest = None if force else load_manifest(manifest_file)
+    previous = None
+    if manifest is not None and os.path.exists(output_file):
+        with open(output_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    else:
+        manifest = None
+    
+    spreadsheet_hash = file_fingerprint(spreadsheet_file)
+    sheet_names = [sheet_name for sheet_name, _ in SHEET_CATEGORIES.values()]
+    if manifest is not None and manifest['spreadsheet'] == spreadsheet_hash:
+        sheet_hashes = manifest['sheets']
+    else:
+        sheet_hashes = sheet_fingerprints(spreadsheet_file, sheet_names)
+    csv_hash = file_fingerprint(PLACE_NAMES_CSV)
+    
+    translations = {}
+    rebuilt = []
+    for category, (sheet_name, extract) in SHEET_CATEGORIES.items():
+        if manifest is not None and manifest['sheets'].get(sheet_name) == sheet_hashes[sheet_name]:
+            translations[category] = previous['translations'][category]
+        else:
+            translations[category] = extract(spreadsheet_file)
+            rebuilt.append(category)
+    
+    if manifest is not None and manifest['place_names_csv'] == csv_hash:
+        translations['site'] = previous['translations']['site']
+    else:
+        translations['site'], complete = _extract_place_names(PLACE_NAMES_CSV, PLACE_NAMES_CHUNK_SIZE)
+        if not complete:
+            csv_hash = None  # not recorded, so the next run reads the file again
+        rebuilt.append('site')
+    
+    if manifest is not None and manifest['spreadsheet'] == spreadsheet_hash:
+        place_names_sources = previous['sources']['place_names_links']
+    else:
+        place_names_sources = get_place_names_sources(spreadsheet_file)
+        rebuilt.append('place name links')  # even with every category unchanged, the links and manifest are rewritten
+    
+    print(f"Rebuilt: {', '.join(rebuilt) if rebuilt else 'nothing (sources unchanged)'}")
+    if not rebuilt and previous is not None and os.path.exists(binary_output_file):
+        return previous
+    
+    technical_terms = translations['nomenclature']
+    species_names = translations['taxon']
+    acronyms_abbreviations = translations['acronym']
+    place_names = translations['site']
     
     all_translations = {
         'metadata': {
@@ -163,6 +333,13 @@ def generate_all_translations(spreadsheet_file="translations_spreadsheet.xlsx",
     }
     
     save_json(all_translations, output_file)
+    write_terminology_binary(all_translations['translations'], binary_output_file)
+    save_json({
+        'version': MANIFEST_VERSION,
+        'spreadsheet': spreadsheet_hash,
+        'sheets': sheet_hashes,
+        'place_names_csv': csv_hash
+    }, manifest_file)
     
     print("\n" + "=" * 50)
     print("TRANSLATION STATISTICS")
@@ -175,6 +352,7 @@ def generate_all_translations(spreadsheet_file="translations_spreadsheet.xlsx",
     print("-" * 50)
     print(f"Total Translations: {stats['total_translations']}")
     print(f"\nSaved to: {output_file}")
+    print(f"Binary index saved to: {binary_output_file}")
     
     return all_translations
 
@@ -11,6 +11,7 @@ MODELS = {
         "lora_dropout": 0.05,
         "save_steps": 1000,
         "eval_steps": 500,
+        "max_tokens": 6144,
     },
     "mbart50_mmt_fr": {
         "batch_size": 8,
@@ -21,6 +22,7 @@ MODELS = {
         "lora_dropout": 0.05,
         "save_steps": 1000,
         "eval_steps": 500,
+        "max_tokens": 4096,
     },
     "mbart50_mmt_en": {
         "batch_size": 8,
@@ -31,6 +33,7 @@ MODELS = {
         "lora_dropout": 0.05,
         "save_steps": 1000,
         "eval_steps": 500,
+        "max_tokens": 4096,
     },
     "opus_mt_en_fr": {
         "batch_size": 16,
@@ -41,6 +44,7 @@ MODELS = {
         "lora_dropout": 0.05,
         "save_steps": 1000,
         "eval_steps": 500,
+        "max_tokens": 8192,
     },
     "opus_mt_fr_en": {
         "batch_size": 16,
@@ -51,6 +55,7 @@ MODELS = {
         "lora_dropout": 0.05,
         "save_steps": 1000,
         "eval_steps": 500,
+        "max_tokens": 8192,
     },
 }
 
@@ -67,6 +72,8 @@ FP16 = False
 NO_QLORA = True
 DEVICE_MAP = "auto"
 DISABLE_TQDM = True
+PREPROCESS_NUM_PROC = 4
+TOKENIZED_CACHE_DIR = "../Data/tokenized_cache"
 
 
 def train_all(training_file, output_root):
@@ -99,6 +106,9 @@ def train_all(training_file, output_root):
             lora_r=int(cfg["lora_r"]),
             lora_alpha=int(cfg["lora_alpha"]),
             lora_dropout=float(cfg["lora_dropout"]),
+            preprocess_num_proc=PREPROCESS_NUM_PROC,
+            tokenized_cache_dir=TOKENIZED_CACHE_DIR,
+            max_tokens=cfg.get("max_tokens"),
         )
 
 
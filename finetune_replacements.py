@@ -1,13 +1,21 @@
-import os, json, logging, math, torch
+import os, json, logging, math, hashlib, random, shutil, torch
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-from datasets import load_dataset
+from datasets import DatasetDict, load_dataset, load_from_disk
 from transformers import (
     AutoTokenizer, AutoModelForSeq2SeqLM, Seq2SeqTrainer, Seq2SeqTrainingArguments,
     DataCollatorForSeq2Seq, BitsAndBytesConfig, EarlyStoppingCallback
 )
 from peft import LoraConfig, get_peft_model
+from torch.utils.data import DataLoader
+
+PREPROCESS_BATCH_SIZE = 1000
+
+# bump when preprocessing changes, so datasets tokenized by older code are not reused
+TOKENIZED_CACHE_VERSION = 1
+
+TOKEN_BUDGET_BUCKET_SIZE = 1000
 
 
 def is_distributed():
@@ -35,10 +43,15 @@ def setup_logging(output_directory, to_file=True):
     logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s", handlers=handlers)
 
 
-def load_tokenizer_and_model(model_id, use_qlora, use_bfloat16, device_map):
+def load_tokenizer(model_id):
     tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True)
     if getattr(tokenizer, "pad_token", None) is None and getattr(tokenizer, "eos_token", None):
         tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+def load_tokenizer_and_model(model_id, use_qlora, use_bfloat16, device_map):
+    tokenizer = load_tokenizer(model_id)
     model_kwargs = {"torch_dtype": torch.bfloat16 if use_bfloat16 else torch.float16, "trust_remote_code": True}
     
     if use_qlora:
@@ -130,6 +143,53 @@ class Preprocessor:
         # by shifting the labels to create decoder_input_ids
         
         return source_tokens
+    
+    def output_columns(self):
+        columns = list(self.tokenizer.model_input_names) + ["labels"]
+        if self.model_name == "m2m100_418m":
+            columns.append("decoder_input_ids")
+        return columns
+    
+    def process_batch(self, batch):
+        # for ds.map(batched=True): rows are grouped by source language so the tokenizer languages are set once per
+        # group and each side is tokenized as one list; rows that __call__ would reject are dropped, order is kept
+        rows_by_language = {}
+        for row, (source_language, source_text, target_text) in enumerate(
+                zip(batch["source_lang"], batch["source"], batch["target"])):
+            if self.restrict_source_language and source_language != self.restrict_source_language:
+                continue
+            target_text = target_text.strip()
+            if not target_text:
+                continue
+            rows_by_language.setdefault(source_language, []).append((row, source_text.strip(), target_text))
+        
+        processed = {}
+        for source_language, rows in rows_by_language.items():
+            target_language = "en" if source_language == "fr" else "fr"
+            self._setup_tokenizer_languages(source_language, target_language)
+            source_tokens = self.tokenizer([source_text for _, source_text, _ in rows], truncation=True,
+                                           max_length=self.max_source_length)
+            target_tokens = self.tokenizer(text_target=[target_text for _, _, target_text in rows], truncation=True,
+                                           max_length=self.max_target_length)
+            
+            if self.model_name == "m2m100_418m":
+                target_language_id = self.tokenizer.get_lang_id(self.language_map[target_language])
+                pad_token_id = self.tokenizer.pad_token_id
+            
+            for position, (row, _, _) in enumerate(rows):
+                labels = target_tokens["input_ids"][position]
+                if not labels:
+                    continue
+                example = {key: values[position] for key, values in source_tokens.items()}
+                example["labels"] = labels
+                if self.model_name == "m2m100_418m":
+                    example["decoder_input_ids"] = [target_language_id] + [
+                        (pad_token_id if token == -100 else token) for token in labels[:-1]
+                    ]
+                processed[row] = example
+        
+        columns = self.output_columns()
+        return {column: [processed[row][column] for row in sorted(processed)] for column in columns}
 
 
 class M2MDataCollator:
@@ -155,6 +215,83 @@ class M2MDataCollator:
         return batch
 
 
+class TokenBudgetBatchSampler:
+    """Batches of dataset indices where rows x longest row stays within max_tokens, instead of a fixed row count
+    
+    Each epoch the indices are shuffled, cut into buckets of bucket_size, sorted by length inside each bucket so
+    similar lengths share a batch, packed greedily up to the budget, and the batches themselves are shuffled.
+    """
+    
+    def __init__(self, lengths, max_tokens, bucket_size=TOKEN_BUDGET_BUCKET_SIZE, shuffle=True, seed=42):
+        self.lengths = list(lengths)
+        self.max_tokens = max_tokens
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._plans = {}
+    
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+    
+    def _plan(self, epoch):
+        if epoch in self._plans:
+            return self._plans[epoch]
+        
+        rng = random.Random(self.seed + epoch)
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+        
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda i: self.lengths[i], reverse=True)
+            batch, longest = [], 0
+            for i in bucket:
+                # a single example longer than the budget still gets a batch of its own
+                if batch and max(longest, self.lengths[i]) * (len(batch) + 1) > self.max_tokens:
+                    batches.append(batch)
+                    batch, longest = [], 0
+                batch.append(i)
+                longest = max(longest, self.lengths[i])
+            if batch:
+                batches.append(batch)
+        
+        if self.shuffle:
+            rng.shuffle(batches)
+        self._plans = {epoch: batches}
+        return batches
+    
+    def __iter__(self):
+        yield from self._plan(self.epoch)
+        self.epoch += 1
+    
+    def __len__(self):
+        return len(self._plan(self.epoch))
+
+
+class TokenBudgetSeq2SeqTrainer(Seq2SeqTrainer):
+    """Seq2SeqTrainer whose training batches come from a TokenBudgetBatchSampler when max_tokens is set"""
+    
+    def __init__(self, *args, max_tokens=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens = max_tokens
+    
+    def get_train_dataloader(self):
+        if self.max_tokens is None:
+            return super().get_train_dataloader()
+        
+        # encoder and decoder are both padded to their longest row, so the longer side sets an example's cost
+        lengths = [max(len(input_ids), len(labels)) for input_ids, labels in
+                   zip(self.train_dataset["input_ids"], self.train_dataset["labels"])]
+        train_dataset = self._remove_unused_columns(self.train_dataset, description="training")
+        batch_sampler = TokenBudgetBatchSampler(lengths, self.max_tokens, seed=self.args.seed)
+        dataloader = DataLoader(train_dataset, batch_sampler=batch_sampler, collate_fn=self.data_collator,
+                                num_workers=self.args.dataloader_num_workers,
+                                pin_memory=self.args.dataloader_pin_memory)
+        return self.accelerator.prepare(dataloader)
+
+
 def filter_dataset_by_model(dataset, model_config):
     if "restrict_source_language" not in model_config:
         return dataset
@@ -162,9 +299,65 @@ def filter_dataset_by_model(dataset, model_config):
     return dataset.filter(lambda x: x["source_lang"] == allowed_lang)
 
 
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    # the serialized fast tokenizer covers vocabulary, merges, normalization and added tokens
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        identity = backend.to_str()
+    else:
+        identity = json.dumps([tokenizer.name_or_path, len(tokenizer), tokenizer.all_special_tokens])
+    return hashlib.sha256(f"{type(tokenizer).__name__}\n{identity}".encode("utf-8")).hexdigest()
+
+
+def tokenized_cache_key(which, data_path, tokenizer, model_info, max_source_len, max_target_len, val_ratio, seed):
+    key = {
+        "version": TOKENIZED_CACHE_VERSION,
+        "model": which,
+        "data": file_sha256(data_path),
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "language_map": model_info["language_map"],
+        "restrict_source_language": model_info.get("restrict_source_language"),
+        "max_source_len": max_source_len,
+        "max_target_len": max_target_len,
+        "val_ratio": val_ratio,
+        "seed": seed,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def load_or_build_tokenized(cache_dir, cache_key, build):
+    # build() returns the tokenized DatasetDict; it is written to a temporary directory and renamed into place, so
+    # an interrupted run or a concurrent rank never leaves a half-written entry behind
+    if cache_dir is None:
+        return build()
+    
+    cache_path = os.path.join(cache_dir, cache_key)
+    if os.path.isdir(cache_path):
+        logging.info(f"tokenized dataset cache hit | {cache_path}")
+        return load_from_disk(cache_path)
+    
+    dataset = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = f"{cache_path}.tmp-{os.getpid()}"
+    dataset.save_to_disk(temporary_path)
+    try:
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        shutil.rmtree(temporary_path, ignore_errors=True)  # another process finished the same entry first
+    return load_from_disk(cache_path)
+
+
 def build_trainer(which, tokenizer, model, dataset_processed, output_directory, learning_rate, batch_size, grad_accum,
                   epochs, max_steps, eval_steps, logging_steps, save_steps, bf16, fp16, seed, warmup_ratio,
-                  disable_tqdm, no_qlora):
+                  disable_tqdm, no_qlora, max_tokens=None):
     if which == "m2m100_418m":
         data_collator = M2MDataCollator(tokenizer, model)
     else:
@@ -202,17 +395,19 @@ def build_trainer(which, tokenizer, model, dataset_processed, output_directory,
         label_names=["labels"],
     )
     try:
-        trainer = Seq2SeqTrainer(model=model, args=training_args,
-                                 train_dataset=dataset_processed["train"],
-                                 eval_dataset=dataset_processed["eval"],
-                                 processing_class=tokenizer, data_collator=data_collator,
-                                 callbacks=[EarlyStoppingCallback(early_stopping_patience=3)])
+        trainer = TokenBudgetSeq2SeqTrainer(model=model, args=training_args,
+                                            train_dataset=dataset_processed["train"],
+                                            eval_dataset=dataset_processed["eval"],
+                                            processing_class=tokenizer, data_collator=data_collator,
+                                            callbacks=[EarlyStoppingCallback(early_stopping_patience=3)],
+                                            max_tokens=max_tokens)
     except TypeError:
-        trainer = Seq2SeqTrainer(model=model, args=training_args,
-                                 train_dataset=dataset_processed["train"],
-                                 eval_dataset=dataset_processed["eval"],
-                                 tokenizer=tokenizer, data_collator=data_collator,
-                                 callbacks=[EarlyStoppingCallback(early_stopping_patience=3)])
+        trainer = TokenBudgetSeq2SeqTrainer(model=model, args=training_args,
+                                            train_dataset=dataset_processed["train"],
+                                            eval_dataset=dataset_processed["eval"],
+                                            tokenizer=tokenizer, data_collator=data_collator,
+                                            callbacks=[EarlyStoppingCallback(early_stopping_patience=3)],
+                                            max_tokens=max_tokens)
     return trainer
 
 
@@ -222,7 +417,8 @@ def finetune_model(which, data_path, output_directory,
                    seed=42, warmup_ratio=0.03, val_ratio=0.05,
                    max_source_len=512, max_target_len=512,
                    bf16=False, fp16=False, no_qlora=False, device_map="auto", disable_tqdm=True,
-                   lora_r=16, lora_alpha=32, lora_dropout=0.05):
+                   lora_r=16, lora_alpha=32, lora_dropout=0.05, preprocess_num_proc=None, tokenized_cache_dir=None,
+                   max_tokens=None):
     if which not in MODELS:
         raise ValueError(f"Model '{which}' not found. Available models: {list(MODELS.keys())}")
     
@@ -230,16 +426,6 @@ def finetune_model(which, data_path, output_directory,
     
     is_opus_model = "opus_mt" in which
     
-    raw = load_dataset("json", data_files=data_path, split="train")
-    raw = filter_dataset_by_model(raw, model_info)
-    
-    if len(raw) == 0:
-        raise ValueError(f"No data remaining after filtering for model {which}")
-    
-    split = raw.train_test_split(test_size=val_ratio, seed=seed)
-    train_ds = split["train"].shuffle(seed=seed)
-    eval_ds = split["test"].shuffle(seed=seed)
-    
     if not no_qlora:
         resolved_device_map = None if is_opus_model else device_map
     else:
@@ -250,20 +436,31 @@ def finetune_model(which, data_path, output_directory,
         else:
             resolved_device_map = device_map
     
-    tokenizer, _ = load_tokenizer_and_model(model_info["model_id"], use_qlora=not no_qlora, use_bfloat16=bf16,
-                                            device_map=resolved_device_map)
+    tokenizer = load_tokenizer(model_info["model_id"])
     
     def preprocess(ds):
         pre = Preprocessor(model_name=which, tokenizer=tokenizer, language_map=model_info["language_map"],
                            max_source_length=max_source_len, max_target_length=max_target_len,
                            restrict_source_language=model_info.get("restrict_source_language"))
-        out = ds.map(pre, remove_columns=ds.column_names, load_from_cache_file=False)
-        out = out.filter(
-            lambda x: "input_ids" in x and "labels" in x and x["labels"] is not None and len(x["labels"]) > 0,
-            load_from_cache_file=False)
-        return out
+        # rows without a usable target are dropped inside process_batch, so no filter pass is needed afterwards
+        return ds.map(pre.process_batch, batched=True, batch_size=PREPROCESS_BATCH_SIZE, num_proc=preprocess_num_proc,
+                      remove_columns=ds.column_names, load_from_cache_file=False)
     
-    dataset_processed = {"train": preprocess(train_ds), "eval": preprocess(eval_ds)}
+    def build_dataset():
+        raw = load_dataset("json", data_files=data_path, split="train")
+        raw = filter_dataset_by_model(raw, model_info)
+        
+        if len(raw) == 0:
+            raise ValueError(f"No data remaining after filtering for model {which}")
+        
+        split = raw.train_test_split(test_size=val_ratio, seed=seed)
+        train_ds = split["train"].shuffle(seed=seed)
+        eval_ds = split["test"].shuffle(seed=seed)
+        return DatasetDict({"train": preprocess(train_ds), "eval": preprocess(eval_ds)})
+    
+    cache_key = tokenized_cache_key(which, data_path, tokenizer, model_info, max_source_len, max_target_len,
+                                    val_ratio, seed) if tokenized_cache_dir is not None else None
+    dataset_processed = load_or_build_tokenized(tokenized_cache_dir, cache_key, build_dataset)
     
     if len(dataset_processed["train"]) == 0:
         raise ValueError(f"No training examples remaining after preprocessing for model {which}")
@@ -274,14 +471,21 @@ def finetune_model(which, data_path, output_directory,
     _, base = load_tokenizer_and_model(model_info["model_id"], use_qlora=not no_qlora, use_bfloat16=bf16,
                                        device_map=resolved_device_map)
     model = attach_lora(base, r=lora_r, alpha=lora_alpha, dropout=lora_dropout)
-    steps_per_epoch = math.ceil(len(dataset_processed["train"]) / (batch_size * grad_accum))
-    logging.info(
-        f"sizes | train={len(dataset_processed['train'])} eval={len(dataset_processed['eval'])} steps/epoch≈{steps_per_epoch}")
-    
     trainer = build_trainer(which, tokenizer, model, dataset_processed, output_directory, learning_rate, batch_size,
                             grad_accum,
                             epochs, None, eval_steps, logging_steps, save_steps, bf16, fp16, seed, warmup_ratio,
-                            disable_tqdm, no_qlora)
+                            disable_tqdm, no_qlora, max_tokens=max_tokens)
+    if max_tokens is None:
+        steps_per_epoch = math.ceil(len(dataset_processed["train"]) / (batch_size * grad_accum))
+        batching = f"batch_size={batch_size}"
+    else:
+        # the batch count depends on the lengths, so it comes from the sampler rather than batch_size
+        steps_per_epoch = max(len(trainer.get_train_dataloader()) // grad_accum, 1)
+        batching = f"token-budgeted batches, max_tokens={max_tokens}"
+    logging.info(
+        f"sizes | train={len(dataset_processed['train'])} eval={len(dataset_processed['eval'])} "
+        f"steps/epoch≈{steps_per_epoch} ({batching})")
+    
     trainer.train()
     model.save_pretrained(os.path.join(output_directory, "lora"))
     tokenizer.save_pretrained(output_directory)
@@ -0,0 +1,106 @@
+import json
+import mmap
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def dumps(item):
+    # compact UTF-8 either way, so the output does not depend on whether orjson is installed
+    if orjson is not None:
+        return orjson.dumps(item)
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def iter_jsonl(file_path, start=0, end=None):
+    # one record at a time; start and end are byte offsets, as returned by shard_byte_ranges
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while end is None or position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                yield loads(line)
+
+
+def iter_jsonl_with_offsets(file_path):
+    # (byte offset of the line, record) pairs, for building indexes that seek straight back to a record
+    with open(file_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                yield offset, loads(line)
+            offset += len(line)
+
+
+def read_jsonl_at(file_path, offsets):
+    # the records starting at the given byte offsets, read through a memory map instead of scanning the file
+    if os.path.getsize(file_path) == 0:
+        return []
+    records = []
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset in offsets:
+            end = mapped.find(b'\n', offset)
+            records.append(loads(mapped[offset:end if end != -1 else len(mapped)]))
+    return records
+
+
+def shard_byte_ranges(file_path, num_shards):
+    # split the file into num_shards byte ranges, each moved forward to start right after a newline
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, 'rb') as f:
+        for i in range(1, num_shards):
+            f.seek(max(size * i // num_shards, boundaries[-1]))
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                f.readline()
+            boundaries.append(min(f.tell(), size))
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+class JsonlWriter:
+    """Appends records to a JSONL file through a large write buffer, so output starts without collecting a list"""
+    
+    def __init__(self, file_path, buffer_size=WRITE_BUFFER_SIZE):
+        self.file_path = file_path
+        self.count = 0
+        self._file = open(file_path, 'wb', buffering=buffer_size)
+    
+    def write(self, item):
+        self._file.write(dumps(item) + b'\n')
+        self.count += 1
+    
+    def write_many(self, items):
+        for item in items:
+            self.write(item)
+    
+    def close(self):
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_jsonl(items, file_path):
+    with JsonlWriter(file_path) as writer:
+        writer.write_many(items)
+    return writer.count
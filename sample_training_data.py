@@ -1,18 +1,14 @@
-import json
+import heapq
+import os
 import random
-from collections import defaultdict, Counter
 import re
 
+import numpy as np
 
-def load_jsonl(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return [json.loads(line) for line in f]
+from corpus_statistics import CorpusStatistics
+from jsonl_io import iter_jsonl, iter_jsonl_with_offsets, read_jsonl_at, save_jsonl
 
-
-def save_jsonl(data, file_path):
-    with open(file_path, 'w', encoding='utf-8') as f:
-        for item in data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+TOKEN_INDEX_VERSION = 1
 
 
 def extract_special_tokens(text):
@@ -20,117 +16,240 @@ def extract_special_tokens(text):
     return re.findall(pattern, text)
 
 
-def get_token_contexts(text, tokens):
-    contexts = []
-    for token in tokens:
-        pattern = rf'\b\w+\s+{re.escape(token)}\s+\w+\b'
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        contexts.extend(matches)
-    return contexts
-
-
-def sample_training_data(input_file, output_file, target_samples=25000, general_ratio=0.15):
-    print(f"Loading data from {input_file}...")
-    data = load_jsonl(input_file)
-    print(f"Loaded {len(data)} samples")
+class KeyedReservoir:
+    """Keeps the items with the smallest random keys seen so far; the first k of them by key are a uniform sample of k"""
     
-    # Separate samples with and without special tokens
-    special_samples = []
-    general_samples = []
-    token_type_counts = defaultdict(list)
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.seen = 0
+        self._heap = []  # max-heap on key, so the largest kept key is the one replaced
     
-    for i, sample in enumerate(data):
-        source_tokens = extract_special_tokens(sample['source'])
-        target_tokens = extract_special_tokens(sample['target'])
-        all_tokens = source_tokens + target_tokens
-        
-        if all_tokens:
-            special_samples.append((i, sample, all_tokens))
-            # Group by token type for balanced sampling
-            for token in set(all_tokens):
-                token_type = token.split('0')[0]  # Get NOMENCLATURE, TAXON, etc.
-                token_type_counts[token_type].append((i, sample, all_tokens))
-        else:
-            general_samples.append((i, sample))
-    
-    print(f"Special token samples: {len(special_samples)}")
-    print(f"General samples: {len(general_samples)}")
-    print(f"Token type distribution: {dict((k, len(v)) for k, v in token_type_counts.items())}")
+    def offer(self, key, item):
+        self.seen += 1
+        if self.capacity <= 0:
+            return
+        entry = (-key, self.seen, item)
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, entry)
+        elif key < -self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
     
-    # Calculate target counts
+    def take(self, k=None):
+        items = [item for _, _, item in sorted(self._heap, reverse=True)]
+        return items if k is None else items[:k]
+
+
+def _select_for_size(target_samples, general_ratio, general, special, types):
+    # every list is ordered by random key and taking prefixes of them, so a smaller size is a subset of a larger one
     general_target = int(target_samples * general_ratio)
     special_target = target_samples - general_target
     
-    # Sample general translation pairs
-    selected_general = random.sample(general_samples, min(general_target, len(general_samples)))
+    selected_general = general.take(general_target)
     print(f"Selected {len(selected_general)} general samples")
     
     # Sample special token samples with balanced token types
     selected_special = []
-    if token_type_counts:
-        samples_per_type = special_target // len(token_type_counts)
-        remainder = special_target % len(token_type_counts)
+    if types:
+        samples_per_type = special_target // len(types)
+        remainder = special_target % len(types)
         
-        for i, (token_type, type_samples) in enumerate(token_type_counts.items()):
+        for i, (token_type, reservoir) in enumerate(types.items()):
             type_target = samples_per_type + (1 if i < remainder else 0)
-            type_selected = random.sample(type_samples, min(type_target, len(type_samples)))
+            type_selected = reservoir.take(type_target)
             selected_special.extend(type_selected)
             print(f"Selected {len(type_selected)} {token_type} samples (target: {type_target})")
     
-    # If we still need more samples, randomly select from remaining special samples
+    # If we still need more samples, take the lowest-keyed special samples not already selected
     if len(selected_special) < special_target:
         used_indices = set(item[0] for item in selected_special)
-        remaining_special = [item for item in special_samples if item[0] not in used_indices]
         additional_needed = special_target - len(selected_special)
-        additional_samples = random.sample(remaining_special, min(additional_needed, len(remaining_special)))
+        additional_samples = [item for item in special.take() if item[0] not in used_indices][:additional_needed]
         selected_special.extend(additional_samples)
         print(f"Added {len(additional_samples)} additional special samples")
     
-    # Combine and shuffle
-    all_selected = [item[1] for item in selected_general] + [item[1] for item in selected_special]
-    random.shuffle(all_selected)
-    
-    print(f"Final sample count: {len(all_selected)}")
-    print(f"General samples: {len(selected_general)} ({len(selected_general) / len(all_selected) * 100:.1f}%)")
-    print(f"Special samples: {len(selected_special)} ({len(selected_special) / len(all_selected) * 100:.1f}%)")
+    return selected_general, selected_special
+
+
+def _report_selection(selected_general, selected_special):
+    total = len(selected_general) + len(selected_special)
+    print(f"Final sample count: {total}")
+    print(f"General samples: {len(selected_general)} ({len(selected_general) / total * 100:.1f}%)")
+    print(f"Special samples: {len(selected_special)} ({len(selected_special) / total * 100:.1f}%)")
     
     # Analyze token diversity in final selection
-    final_token_counts = Counter()
-    context_diversity = []
+    statistics = CorpusStatistics()
+    for item in selected_general + selected_special:
+        statistics.update(item[1])
+    report = statistics.report()
+    final_token_counts = {category: counts['source_tokens'] + counts['target_tokens']
+                          for category, counts in report['categories'].items() if counts['records']}
+    
+    print(f"Final token type distribution: {final_token_counts}")
+    print(f"Unique contexts found: {report['contexts']['unique']}")
+
+
+def sample_training_data_sizes(input_file, output_files, general_ratio=0.15, seed=None):
+    # output_files maps each target sample count to its output path; the file is read once and the samples are nested
+    rng = random if seed is None else random.Random(seed)
+    largest = max(output_files)
+    general_capacity = int(largest * general_ratio)
+    special_capacity = largest - general_capacity
     
-    for sample in all_selected:
+    print(f"Streaming data from {input_file}...")
+    general = KeyedReservoir(general_capacity)
+    special = KeyedReservoir(special_capacity)
+    types = {}  # token type -> reservoir, in order of first appearance
+    
+    for i, sample in enumerate(iter_jsonl(input_file)):
         source_tokens = extract_special_tokens(sample['source'])
         target_tokens = extract_special_tokens(sample['target'])
         all_tokens = source_tokens + target_tokens
+        item = (i, sample, source_tokens, target_tokens)
         
-        for token in all_tokens:
-            token_type = token.split('0')[0]
-            final_token_counts[token_type] += 1
+        if all_tokens:
+            special.offer(rng.random(), item)
+            # Group by token type for balanced sampling, with an independent key per type
+            for token in set(all_tokens):
+                token_type = token.split('0')[0]  # Get NOMENCLATURE, TAXON, etc.
+                if token_type not in types:
+                    types[token_type] = KeyedReservoir(special_capacity)
+                types[token_type].offer(rng.random(), item)
+        else:
+            general.offer(rng.random(), item)
+    
+    print(f"Loaded {general.seen + special.seen} samples")
+    print(f"Special token samples: {special.seen}")
+    print(f"General samples: {general.seen}")
+    print(f"Token type distribution: {dict((k, v.seen) for k, v in types.items())}")
+    
+    for target_samples in sorted(output_files):
+        output_file = output_files[target_samples]
+        print(f"\nSample of {target_samples}:")
+        selected_general, selected_special = _select_for_size(target_samples, general_ratio, general, special, types)
         
-        # Analyze contexts
-        contexts = get_token_contexts(sample['source'], source_tokens)
-        contexts.extend(get_token_contexts(sample['target'], target_tokens))
-        context_diversity.extend(contexts)
+        # Combine and shuffle
+        all_selected = [item[1] for item in selected_general] + [item[1] for item in selected_special]
+        rng.shuffle(all_selected)
+        _report_selection(selected_general, selected_special)
+        
+        # Save sampled data
+        save_jsonl(all_selected, output_file)
+        print(f"Saved {len(all_selected)} samples to {output_file}")
+
+
+def token_index_path(input_file):
+    return os.path.splitext(input_file)[0] + '.token_index.npz'
+
+
+def build_token_type_index(input_file, index_file=None):
+    # one pass that records the byte offset of every line under each token type it contains (or 'general'), plus
+    # 'special' for any line with a token, so later samples can seek straight to the chosen lines
+    index_file = index_file or token_index_path(input_file)
+    print(f"Indexing {input_file}...")
+    offsets = {'general': [], 'special': []}
+    types = []
+    
+    for offset, sample in iter_jsonl_with_offsets(input_file):
+        all_tokens = extract_special_tokens(sample['source']) + extract_special_tokens(sample['target'])
+        if not all_tokens:
+            offsets['general'].append(offset)
+            continue
+        offsets['special'].append(offset)
+        for token in set(all_tokens):
+            token_type = token.split('0')[0]
+            if token_type not in offsets:
+                offsets[token_type] = []
+                types.append(token_type)
+            offsets[token_type].append(offset)
+    
+    stat = os.stat(input_file)
+    arrays = {f"offsets_{name}": np.asarray(values, dtype=np.int64) for name, values in offsets.items()}
+    temporary_file = index_file + '.tmp'
+    with open(temporary_file, 'wb') as f:
+        np.savez(f, version=TOKEN_INDEX_VERSION, source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns,
+                 types=np.asarray(types, dtype=str), **arrays)
+    os.replace(temporary_file, index_file)
+    print(f"Saved index of {len(offsets['general']) + len(offsets['special'])} lines to {index_file}")
+
+
+def load_token_type_index(input_file, index_file=None):
+    # rebuilt whenever the data file's size or modification time no longer match the ones it was built from
+    index_file = index_file or token_index_path(input_file)
+    stat = os.stat(input_file)
+    if os.path.exists(index_file):
+        with np.load(index_file) as index:
+            if (int(index['version']) == TOKEN_INDEX_VERSION and int(index['source_size']) == stat.st_size
+                    and int(index['source_mtime_ns']) == stat.st_mtime_ns):
+                types = [str(token_type) for token_type in index['types']]
+                return {name: index[f"offsets_{name}"] for name in ['general', 'special'] + types}, types
+    
+    build_token_type_index(input_file, index_file)
+    return load_token_type_index(input_file, index_file)
+
+
+class ShuffledOffsets:
+    """Line offsets of one group in a random order drawn up front; the first k are a uniform sample of k"""
     
-    print(f"Final token type distribution: {dict(final_token_counts)}")
-    print(f"Unique contexts found: {len(set(context_diversity))}")
+    def __init__(self, offsets, capacity, rng):
+        self.seen = len(offsets)
+        self._order = offsets[rng.choice(len(offsets), size=min(capacity, len(offsets)), replace=False)]
     
-    # Save sampled data
-    save_jsonl(all_selected, output_file)
-    print(f"Saved {len(all_selected)} samples to {output_file}")
+    def take(self, k=None):
+        chosen = self._order if k is None else self._order[:k]
+        return [(int(offset),) for offset in chosen]
+
+
+def sample_training_data_indexed(input_file, output_files, general_ratio=0.15, seed=None, index_file=None):
+    # same selection rules and nesting as sample_training_data_sizes, but drawn from the offset index, so only the
+    # chosen lines are read and parsed
+    offsets, types = load_token_type_index(input_file, index_file)
+    rng = np.random.default_rng(seed)
+    largest = max(output_files)
+    general_capacity = int(largest * general_ratio)
+    special_capacity = largest - general_capacity
+    
+    general = ShuffledOffsets(offsets['general'], general_capacity, rng)
+    special = ShuffledOffsets(offsets['special'], special_capacity, rng)
+    type_offsets = {token_type: ShuffledOffsets(offsets[token_type], special_capacity, rng) for token_type in types}
+    print(f"Indexed samples: {general.seen + special.seen} ({special.seen} special, {general.seen} general)")
+    
+    for target_samples in sorted(output_files):
+        output_file = output_files[target_samples]
+        print(f"\nSample of {target_samples}:")
+        selected_general, selected_special = _select_for_size(target_samples, general_ratio, general, special,
+                                                              type_offsets)
+        
+        # read only the chosen lines, then give them the same shape the streaming sampler keeps
+        selected = []
+        for group in (selected_general, selected_special):
+            records = read_jsonl_at(input_file, [offset for offset, in group])
+            selected.append([(offset, sample, extract_special_tokens(sample['source']),
+                              extract_special_tokens(sample['target']))
+                             for (offset,), sample in zip(group, records)])
+        selected_general, selected_special = selected
+        
+        # Combine and shuffle
+        all_selected = [item[1] for item in selected_general] + [item[1] for item in selected_special]
+        rng.shuffle(all_selected)
+        _report_selection(selected_general, selected_special)
+        
+        # Save sampled data
+        save_jsonl(all_selected, output_file)
+        print(f"Saved {len(all_selected)} samples to {output_file}")
+
+
+def sample_training_data(input_file, output_file, target_samples=25000, general_ratio=0.15, seed=None):
+    sample_training_data_sizes(input_file, {target_samples: output_file}, general_ratio=general_ratio, seed=seed)
 
 
 if __name__ == "__main__":
-    random.seed(42)
-    sample_training_data(
-        input_file="../Data/training_replacements.jsonl",
-        output_file="../Data/training_replacements_sampled.jsonl",
-        target_samples=25000,
-        general_ratio=0.15
-    )
-    sample_training_data(
+    # the offset index is built on the first run and reused until training_replacements.jsonl changes
+    sample_training_data_indexed(
         input_file="../Data/training_replacements.jsonl",
-        output_file="../Data/training_replacements_sampled_100k.jsonl",
-        target_samples=100000,
-        general_ratio=0.15
+        output_files={
+            25000: "../Data/training_replacements_sampled.jsonl",
+            100000: "../Data/training_replacements_sampled_100k.jsonl"
+        },
+        general_ratio=0.15,
+        seed=42
     )
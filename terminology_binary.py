@@ -0,0 +1,163 @@
+import mmap
+import struct
+from collections.abc import Mapping
+
+# Layout (little-endian u32 throughout, offsets from the start of the file):
+#   header           magic, version, category count
+#   category table   name offset, name length, entry count, entries offset, sorted index offset
+#   entries          key offset, key length, value offset, value length, in the original dictionary order
+#   sorted index     entry numbers ordered by lowercased key, for case-insensitive binary search
+#   string blob      UTF-8 category names, keys and values
+MAGIC = b"RBTI"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+CATEGORY = struct.Struct("<IIIII")
+ENTRY = struct.Struct("<IIII")
+INDEX = struct.Struct("<I")
+
+
+def write_terminology_binary(translations, file_path):
+    blob = bytearray()
+    blob_offsets = {}
+    
+    def add_string(text):
+        if text not in blob_offsets:
+            encoded = text.encode("utf-8")
+            blob_offsets[text] = (len(blob), len(encoded))
+            blob.extend(encoded)
+        return blob_offsets[text]
+    
+    categories = list(translations.items())
+    tables_size = HEADER.size + CATEGORY.size * len(categories)
+    tables_size += sum((ENTRY.size + INDEX.size) * len(terms) for _, terms in categories)
+    
+    header = bytearray(HEADER.pack(MAGIC, VERSION, len(categories)))
+    category_table = bytearray()
+    entry_tables = bytearray()
+    for category, terms in categories:
+        items = [(str(key), str(value)) for key, value in terms.items()]
+        entries_offset = HEADER.size + CATEGORY.size * len(categories) + len(entry_tables)
+        name_offset, name_length = add_string(category)
+        
+        entries = bytearray()
+        for key, value in items:
+            key_offset, key_length = add_string(key)
+            value_offset, value_length = add_string(value)
+            entries.extend(ENTRY.pack(tables_size + key_offset, key_length, tables_size + value_offset, value_length))
+        
+        # stable sort, so among keys that differ only by case the first one in the dictionary comes first
+        order = sorted(range(len(items)), key=lambda i: items[i][0].lower())
+        sorted_index = b"".join(INDEX.pack(i) for i in order)
+        
+        category_table.extend(CATEGORY.pack(tables_size + name_offset, name_length, len(items), entries_offset,
+                                            entries_offset + len(entries)))
+        entry_tables.extend(entries)
+        entry_tables.extend(sorted_index)
+    
+    with open(file_path, "wb") as f:
+        f.write(header)
+        f.write(category_table)
+        f.write(entry_tables)
+        f.write(blob)
+
+
+class MappedCategory(Mapping):
+    """Read-only view of one category of a memory-mapped terminology file, in the original dictionary order"""
+    
+    def __init__(self, buffer, entry_count, entries_offset, index_offset):
+        self._buffer = buffer
+        self._entry_count = entry_count
+        self._entries_offset = entries_offset
+        self._index_offset = index_offset
+    
+    def _string(self, offset, length):
+        return self._buffer[offset:offset + length].decode("utf-8")
+    
+    def _entry(self, entry_number):
+        key_offset, key_length, value_offset, value_length = ENTRY.unpack_from(
+            self._buffer, self._entries_offset + entry_number * ENTRY.size)
+        return self._string(key_offset, key_length), (value_offset, value_length)
+    
+    def _key(self, entry_number):
+        return self._entry(entry_number)[0]
+    
+    def _sorted_entry(self, position):
+        return INDEX.unpack_from(self._buffer, self._index_offset + position * INDEX.size)[0]
+    
+    def _first_position(self, folded_key):
+        low, high = 0, self._entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(self._sorted_entry(middle)).lower() < folded_key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def canonical_key(self, text):
+        # first key in dictionary order that matches text case-insensitively
+        folded_key = text.lower()
+        position = self._first_position(folded_key)
+        if position < self._entry_count:
+            key = self._key(self._sorted_entry(position))
+            if key.lower() == folded_key:
+                return key
+        return None
+    
+    def __getitem__(self, key):
+        folded_key = key.lower()
+        position = self._first_position(folded_key)
+        while position < self._entry_count:
+            candidate, (value_offset, value_length) = self._entry(self._sorted_entry(position))
+            if candidate.lower() != folded_key:
+                break
+            if candidate == key:
+                return self._string(value_offset, value_length)
+            position += 1
+        raise KeyError(key)
+    
+    def __iter__(self):
+        for entry_number in range(self._entry_count):
+            yield self._key(entry_number)
+    
+    def __len__(self):
+        return self._entry_count
+
+
+class FoldedKeys:
+    """Lowercase -> original key lookups answered from the sorted index instead of a per-process dict"""
+    
+    def __init__(self, category):
+        self._category = category
+    
+    def get(self, folded_key, default=None):
+        key = self._category.canonical_key(folded_key)
+        return default if key is None else key
+
+
+class MappedTerminology:
+    """Terminology file written by write_terminology_binary, memory-mapped so worker processes share one copy"""
+    
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, version, category_count = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{file_path} is not a version {VERSION} terminology file")
+        
+        self.translations = {}
+        for i in range(category_count):
+            name_offset, name_length, entry_count, entries_offset, index_offset = CATEGORY.unpack_from(
+                self._buffer, HEADER.size + i * CATEGORY.size)
+            name = self._buffer[name_offset:name_offset + name_length].decode("utf-8")
+            self.translations[name] = MappedCategory(self._buffer, entry_count, entries_offset, index_offset)
+    
+    def close(self):
+        self._buffer.close()
+
+
+def load_terminology_binary(file_path):
+    # same shape as the JSON written by create_translations_json, so TerminologyIndex accepts either
+    return {'translations': MappedTerminology(file_path).translations}
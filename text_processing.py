@@ -1,22 +1,64 @@
+import bisect
+import functools
+import itertools
 import json
+import os
 import re
 import subprocess
 import sys
-import spacy
+from collections import Counter, OrderedDict, deque
 
+from terminology_binary import FoldedKeys, MappedCategory, load_terminology_binary
 
-def ensure_spacy_model(model_name="en_core_web_sm"):
+
+SPACY_MODEL = "en_core_web_sm"
+
+# only doc.ents is read, so everything except the entity recognizer is left out when the pipeline loads
+UNUSED_SPACY_COMPONENTS = ["tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer"]
+
+TOKEN_PATTERN = re.compile(r'(?:NOMENCLATURE|TAXON|ACRONYM|SITE)\d{4}')
+
+SENTENCE_END_PATTERN = re.compile(r'[.!?]["\')\]]*\s+(?=["\'(\[]?[A-Z0-9])')
+
+# a period after these does not end a sentence ("Gulf of St. Lawrence", "Fig. 3", "Smith et al. 2019")
+NON_TERMINAL_ABBREVIATIONS = {'st', 'ste', 'mt', 'dr', 'mr', 'mrs', 'ms', 'fig', 'figs', 'no', 'vol', 'al', 'e.g', 'i.e',
+                              'approx', 'ca', 'vs', 'cf'}
+
+_nlp = None
+
+
+def load_spacy_model(model_name=SPACY_MODEL):
+    import spacy
+    
+    try:
+        return spacy.load(model_name, exclude=UNUSED_SPACY_COMPONENTS)
+    except OSError as e:
+        raise OSError(f"spaCy model '{model_name}' is not installed. Install it with "
+                      f"'{sys.executable} -m spacy download {model_name}' or call ensure_spacy_model().") from e
+
+
+def ensure_spacy_model(model_name=SPACY_MODEL):
     try:
-        nlp_out = spacy.load(model_name)
-        return nlp_out
+        return load_spacy_model(model_name)
     except OSError:
         print(f"Model '{model_name}' not found. Downloading now...")
         subprocess.check_call([sys.executable, "-m", "spacy", "download", model_name])
         print(f"Model '{model_name}' downloaded successfully!")
-        return spacy.load(model_name)
+        return load_spacy_model(model_name)
 
 
-nlp = ensure_spacy_model("en_core_web_sm")
+def get_nlp():
+    global _nlp
+    if _nlp is None:
+        _nlp = load_spacy_model()
+    return _nlp
+
+
+def set_nlp(nlp_model):
+    global _nlp
+    _nlp = nlp_model
+    if _place_cache is not None:
+        _place_cache.clear()  # cached places came from the previous model
 
 
 def load_translations(json_file="../Data/preferential_translations.json"):
@@ -24,10 +66,16 @@ def load_translations(json_file="../Data/preferential_translations.json"):
         return json.load(f)
 
 
-def create_search_patterns(translations_data):
+# looked up by spaCy place spans only, never searched for; the .bin 'site' category is far too large to sort at load
+MATCHER_SKIP_CATEGORIES = ('site',)
+
+
+def create_search_patterns(translations_data, skip_categories=()):
     patterns = {}
     
     for category, translations in translations_data['translations'].items():
+        if category in skip_categories:
+            continue
         # Sort by length (longest first) to match longer phrases first
         sorted_terms = sorted(translations.keys(), key=len, reverse=True)
         patterns[category] = sorted_terms
@@ -35,6 +83,184 @@ def create_search_patterns(translations_data):
     return patterns
 
 
+def fold_case(text):
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    # a few characters expand when lowercased; fold those one by one so offsets still line up with the original text
+    return ''.join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+
+class TermMatcher:
+    """Aho-Corasick automaton that finds every occurrence of a set of terms in a single pass over the text"""
+    
+    def __init__(self, terms, ignore_case=True):
+        self.ignore_case = ignore_case
+        self._goto = [{}]
+        self._fail = [0]
+        self._values = [None]
+        self._lengths = [0]
+        self._output_link = [0]
+        
+        for term, value in terms:
+            if term:
+                self._add_term(term, value)
+        self._build_failure_links()
+    
+    def _add_term(self, term, value):
+        key = fold_case(term) if self.ignore_case else term
+        node = 0
+        for char in key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._values.append(None)
+                self._lengths.append(0)
+                self._output_link.append(0)
+            node = next_node
+        
+        # first term added wins when several fold to the same key
+        if self._values[node] is None:
+            self._values[node] = value
+            self._lengths[node] = len(key)
+    
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._output_link[child] = fail if self._values[fail] is not None else self._output_link[fail]
+                queue.append(child)
+    
+    def iter_matches(self, text):
+        goto, fail, values, lengths, output_link = self._goto, self._fail, self._values, self._lengths, self._output_link
+        key = fold_case(text) if self.ignore_case else text
+        node = 0
+        for end, char in enumerate(key, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            output = node if values[node] is not None else output_link[node]
+            while output:
+                yield end - lengths[output], end, values[output]
+                output = output_link[output]
+
+
+def build_term_matcher(patterns, skip_categories=MATCHER_SKIP_CATEGORIES):
+    # priority is (category order, rank in the longest-first pattern list), so the automaton keeps the best entry
+    entries = []
+    for category_index, (category, terms) in enumerate(patterns.items()):
+        if category in skip_categories:
+            continue
+        for rank, term in enumerate(terms):
+            entries.append((term, (category_index, rank, category, term)))
+    return TermMatcher(entries)
+
+
+class TerminologyIndex:
+    """Preferential translations loaded once, with the patterns, matcher and case-insensitive lookups precomputed"""
+    
+    def __init__(self, translations_data):
+        self.translations = translations_data['translations']
+        self.patterns = create_search_patterns(translations_data, skip_categories=MATCHER_SKIP_CATEGORIES)
+        self.matcher = build_term_matcher(self.patterns)
+        
+        # lowercase -> original key, keeping the first key when several differ only by case
+        self.canonical_keys = {}
+        for category, translations in self.translations.items():
+            if isinstance(translations, MappedCategory):
+                self.canonical_keys[category] = FoldedKeys(translations)
+                continue
+            keys = {}
+            for key in translations.keys():
+                keys.setdefault(key.lower(), key)
+            self.canonical_keys[category] = keys
+    
+    @classmethod
+    def from_file(cls, translations_file="../Data/preferential_translations.json"):
+        # the .bin artifact from create_translations_json is memory-mapped instead of parsed
+        if translations_file.endswith(".bin"):
+            return cls(load_terminology_binary(translations_file))
+        return cls(load_translations(translations_file))
+    
+    def canonical_key(self, category, text):
+        return self.canonical_keys.get(category, {}).get(text.lower())
+    
+    def lookup(self, category, text):
+        key = self.canonical_key(category, text)
+        if key is None:
+            return None
+        return self.translations[category][key]
+
+
+@functools.lru_cache(maxsize=None)
+def get_terminology_index(translations_file="../Data/preferential_translations.json"):
+    return TerminologyIndex.from_file(translations_file)
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+def is_word_boundary(text, position):
+    before = position > 0 and _is_word_char(text[position - 1])
+    after = position < len(text) and _is_word_char(text[position])
+    return before != after
+
+
+# Overlapping spans are settled by priority: spaCy places first, then dictionary categories in file order,
+# longer terms before shorter ones within a category, and the leftmost span when the priority ties.
+PLACE_PRIORITY = (0,)
+
+
+def iter_term_spans(matcher, text):
+    for start, end, (category_index, rank, category, term) in matcher.iter_matches(text):
+        if is_word_boundary(text, start) and is_word_boundary(text, end):
+            yield (1, category_index, rank), start, end, category, term
+
+
+def _overlaps_accepted(starts, ends, start, end):
+    index = bisect.bisect_right(starts, start)
+    if index and ends[index - 1] > start:
+        return True
+    return index < len(starts) and starts[index] < end
+
+
+def resolve_spans(candidates):
+    accepted = []
+    starts, ends = [], []
+    for priority, start, end, category, term in sorted(candidates, key=lambda span: span[:3]):
+        if _overlaps_accepted(starts, ends, start, end):
+            continue
+        index = bisect.bisect_right(starts, start)
+        starts.insert(index, start)
+        ends.insert(index, end)
+        accepted.append((priority, start, end, category, term))
+    
+    # tokens are numbered in priority order, last occurrence first, as the old replace-in-place passes did
+    accepted.sort(key=lambda span: (span[0], -span[1]))
+    return accepted
+
+
+def render_spans(text, replacements):
+    pieces = []
+    position = 0
+    for start, end, replacement in sorted(replacements):
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
 def preserve_capitalization(original_text, replacement_text, is_sentence_start=False):
     if not original_text or not replacement_text:
         return replacement_text
@@ -54,10 +280,109 @@ def preserve_capitalization(original_text, replacement_text, is_sentence_start=F
         return replacement_text
 
 
-def detect_places_with_nlp(text):
+class PlaceCache:
+    """Bounded LRU cache of spaCy place spans, keyed on the sentence with surrounding whitespace trimmed"""
+    
+    def __init__(self, max_entries=50000, max_bytes=64 * 1024 * 1024, path=None, model_name=SPACY_MODEL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.model_name = model_name
+        self._entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        
+        if path and os.path.exists(path):
+            self.load(path)
+    
+    @staticmethod
+    def _normalize(text):
+        return text.strip(), len(text) - len(text.lstrip())
+    
+    @staticmethod
+    def _entry_size(key, places):
+        return sys.getsizeof(key) + sum(sys.getsizeof(place_text) + 120 for _, _, place_text in places) + 200
+    
+    def get(self, text):
+        key, offset = self._normalize(text)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return [(start + offset, end + offset, place_text) for start, end, place_text in entry[0]]
+    
+    def put(self, text, places):
+        key, offset = self._normalize(text)
+        relative = [(start - offset, end - offset, place_text) for start, end, place_text in places]
+        size = self._entry_size(key, relative)
+        if size > self.max_bytes:
+            return
+        
+        if key in self._entries:
+            self.size_bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (relative, size)
+        self.size_bytes += size
+        
+        while self._entries and (len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+    
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'size_bytes': self.size_bytes
+        }
+    
+    def save(self, path=None):
+        path = path or self.path
+        data = {
+            'model_name': self.model_name,
+            'entries': [[key, places] for key, (places, _) in self._entries.items()]  # least recently used first
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+    
+    def load(self, path=None):
+        path = path or self.path
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        if data.get('model_name') != self.model_name:
+            print(f"Warning: ignoring place cache {path} built with model '{data.get('model_name')}'")
+            return
+        
+        for key, places in data['entries']:
+            self.put(key, [tuple(place) for place in places])
+
+
+_place_cache = PlaceCache()
+
+
+def get_place_cache():
+    return _place_cache
+
+
+def set_place_cache(cache):
+    # None turns caching off
+    global _place_cache
+    _place_cache = cache
+
+
+def places_from_doc(doc):
     places = []
     
-    doc = nlp(text)
     for ent in doc.ents:
         if ent.label_ in ['GPE', 'LOC', 'FAC']:  # GPE=Geopolitical, LOC=Location, FAC=Facility
             places.append((ent.start_char, ent.end_char, ent.text))
@@ -65,11 +390,61 @@ def detect_places_with_nlp(text):
     return places
 
 
-def preprocess_for_translation(text, translations_file="../Data/preferential_translations.json"):
-    translations_data = load_translations(translations_file)
-    patterns = create_search_patterns(translations_data)
+def detect_places_with_nlp(text, nlp_model=None):
+    # the shared cache only holds results from the shared model
+    cache = _place_cache if nlp_model is None else None
+    if cache is not None:
+        places = cache.get(text)
+        if places is not None:
+            return places
+    
+    places = places_from_doc((nlp_model or get_nlp())(text))
+    if cache is not None:
+        cache.put(text, places)
+    return places
+
+
+def _pipe_inputs(texts, cache):
+    # cache hits still pass through the pipe (as an empty doc) so results stay in input order
+    for text in texts:
+        places = cache.get(text) if cache is not None else None
+        yield ('' if places is not None else text), (text, places)
+
+
+def preprocess_for_translation(text, translations_file="../Data/preferential_translations.json", terminology=None):
+    if terminology is None:
+        terminology = get_terminology_index(translations_file)
     
-    processed_text = text
+    return tokenize_terms(text, detect_places_with_nlp(text), terminology)
+
+
+def iter_preprocess_batch(texts, batch_size=64, n_process=1,
+                          translations_file="../Data/preferential_translations.json", terminology=None,
+                          nlp_model=None):
+    if terminology is None:
+        terminology = get_terminology_index(translations_file)
+    cache = _place_cache if nlp_model is None else None
+    if nlp_model is None:
+        nlp_model = get_nlp()
+    
+    # carry the original text alongside each doc so results line up even with several worker processes
+    docs = nlp_model.pipe(_pipe_inputs(texts, cache), as_tuples=True, batch_size=batch_size, n_process=n_process)
+    for doc, (text, places) in docs:
+        if places is None:
+            places = places_from_doc(doc)
+            if cache is not None:
+                cache.put(text, places)
+        yield tokenize_terms(text, places, terminology)
+
+
+def preprocess_batch(texts, batch_size=64, n_process=1, translations_file="../Data/preferential_translations.json",
+                     terminology=None, nlp_model=None):
+    return list(iter_preprocess_batch(texts, batch_size=batch_size, n_process=n_process,
+                                      translations_file=translations_file, terminology=terminology,
+                                      nlp_model=nlp_model))
+
+
+def tokenize_terms(text, places, terminology):
     token_mapping = {}
     token_counters = {
         'nomenclature': 0,
@@ -79,103 +454,91 @@ def preprocess_for_translation(text, translations_file="../Data/preferential_tra
         'nlp_places': 0
     }
     
-    # Step 1: First detect NLP places and tokenize them
-    nlp_places = detect_places_with_nlp(processed_text)
-    for start, end, place_text in reversed(nlp_places):  # Reverse to maintain indices
-        token_counters['nlp_places'] += 1
-        token = f"SITE{token_counters['nlp_places']:04d}"
-        
-        # Check if this place has a known translation
-        place_translation = None
-        for place_key, translation in translations_data['translations']['site'].items():
-            if place_key.lower() == place_text.lower():
-                place_translation = translation
-                break
-        
-        # Store mapping
-        token_mapping[token] = {
-            'original_text': place_text,
-            'category': 'nlp_places',
-            'translation': place_translation,
-            'should_translate': place_translation is not None
-        }
+    # Collect NLP places and dictionary terms (excluding site since NLP handles those) against the original text
+    candidates = [(PLACE_PRIORITY, start, end, 'nlp_places', place_text)
+                  for start, end, place_text in places]
+    candidates.extend(iter_term_spans(terminology.matcher, text))
+    
+    replacements = []
+    for _, start, end, category, term in resolve_spans(candidates):
+        original_text = text[start:end]
+        token_counters[category] += 1
         
-        # Replace in text
-        processed_text = processed_text[:start] + token + processed_text[end:]
-    
-    # Step 2: Process dictionary-based terms (excluding site since NLP handles those)
-    for category, terms in patterns.items():
-        if category == 'site':
-            continue  # Skip - handled by NLP above
-        
-        category_short = category.split('_')[0].upper()
-        
-        for term in terms:
-            # Case-insensitive search for the term as whole words/phrases
-            # Use word boundaries for single words, but allow phrase matching
-            if ' ' in term:
-                # Multi-word phrase - match exactly
-                pattern = re.compile(re.escape(term), re.IGNORECASE)
-            else:
-                # Single word - use word boundaries to avoid partial matches
-                pattern = re.compile(r'\b' + re.escape(term) + r'\b', re.IGNORECASE)
+        if category == 'nlp_places':
+            token = f"SITE{token_counters[category]:04d}"
             
-            matches = list(pattern.finditer(processed_text))
+            # Check if this place has a known translation
+            place_translation = terminology.lookup('site', original_text)
+            token_mapping[token] = {
+                'original_text': original_text,
+                'category': category,
+                'translation': place_translation,
+                'should_translate': place_translation is not None
+            }
+        else:
+            category_short = category.split('_')[0].upper()
+            token = f"{category_short}{token_counters[category]:04d}"
             
-            for match in reversed(matches):  # Reverse to maintain indices
-                original_text = match.group()
-                start, end = match.span()
-                
-                # Create token
-                token_counters[category] += 1
-                token = f"{category_short}{token_counters[category]:04d}"
-                
-                # Get the correct translation key (use original case from translations)
-                translation_key = None
-                for original_key in translations_data['translations'][category].keys():
-                    if original_key.lower() == term.lower():
-                        translation_key = original_key
-                        break
-                
-                # Store mapping
-                token_mapping[token] = {
-                    'original_text': original_text,
-                    'category': category,
-                    'translation': translations_data['translations'][category].get(translation_key, None) if translation_key else None,
-                    'should_translate': True
-                }
-                
-                # Replace in text
-                processed_text = processed_text[:start] + token + processed_text[end:]
-    
-    return processed_text, token_mapping
+            # lookup resolves the original case of the key from translations
+            token_mapping[token] = {
+                'original_text': original_text,
+                'category': category,
+                'translation': terminology.lookup(category, term),
+                'should_translate': True
+            }
+        
+        replacements.append((start, end, token))
+    
+    return render_spans(text, replacements), token_mapping
 
 
-def postprocess_translation(translated_text, token_mapping):
-    result_text = translated_text
+def postprocess_translation_with_report(translated_text, token_mapping):
+    pieces = []
+    position = 0
+    last_visible_char = ''
+    token_counts = Counter()
+    unexpected = []
     
-    for token in token_mapping.keys():
-        if token in result_text:
-            mapping = token_mapping[token]
-            
-            # capitalise if token ends up at the start of the sentence
-            token_position = result_text.find(token)
-            is_sentence_start = False
-            if token_position == 0:
-                is_sentence_start = True
-            elif token_position > 0:
-                preceding_text = result_text[:token_position].rstrip()
-                if preceding_text and preceding_text[-1] in '.!?':
-                    is_sentence_start = True
-            
-            if mapping['should_translate'] and mapping['translation'] and mapping['translation'] != 'None':
-                replacement = preserve_capitalization(mapping['original_text'], mapping['translation'], is_sentence_start)
-            else:
-                replacement = mapping['original_text']
-            
-            result_text = result_text.replace(token, replacement)
+    for match in TOKEN_PATTERN.finditer(translated_text):
+        token = match.group()
+        mapping = token_mapping.get(token)
+        if mapping is None:
+            if token not in unexpected:
+                unexpected.append(token)
+            continue
+        
+        preceding_text = translated_text[position:match.start()].rstrip()
+        if preceding_text:
+            last_visible_char = preceding_text[-1]
+        
+        # capitalise if token ends up at the start of the sentence
+        is_sentence_start = match.start() == 0 or (last_visible_char != '' and last_visible_char in '.!?')
+        
+        if mapping['should_translate'] and mapping['translation'] and mapping['translation'] != 'None':
+            replacement = preserve_capitalization(mapping['original_text'], mapping['translation'], is_sentence_start)
+        else:
+            replacement = mapping['original_text']
+        
+        pieces.append(translated_text[position:match.start()])
+        pieces.append(replacement)
+        position = match.end()
+        token_counts[token] += 1
+        if replacement.rstrip():
+            last_visible_char = replacement.rstrip()[-1]
     
-    return result_text
+    pieces.append(translated_text[position:])
+    
+    report = {
+        'missing': [token for token in token_mapping if token not in token_counts],
+        'duplicated': [token for token, count in token_counts.items() if count > 1],
+        'unexpected': unexpected
+    }
+    report['valid'] = not (report['missing'] or report['duplicated'] or report['unexpected'])
+    return ''.join(pieces), report
+
+
+def postprocess_translation(translated_text, token_mapping):
+    return postprocess_translation_with_report(translated_text, token_mapping)[0]
 
 
 def get_translation_statistics(token_mapping):
@@ -187,3 +550,74 @@ def get_translation_statistics(token_mapping):
         stats[category] += 1
     
     return stats
+
+
+def iter_paragraphs(lines):
+    paragraph = []
+    for line in lines:
+        if line.strip():
+            paragraph.append(line.strip())
+        elif paragraph:
+            yield ' '.join(paragraph)
+            paragraph = []
+    if paragraph:
+        yield ' '.join(paragraph)
+
+
+def split_sentences(paragraph):
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(paragraph):
+        preceding_words = paragraph[max(start, match.start() - 20):match.start()].split()
+        last_word = preceding_words[-1] if preceding_words else ''
+        if last_word.lower() in NON_TERMINAL_ABBREVIATIONS or (len(last_word) == 1 and last_word.isupper()):
+            continue
+        sentences.append(paragraph[start:match.end()].rstrip())
+        start = match.end()
+    if paragraph[start:].strip():
+        sentences.append(paragraph[start:].strip())
+    return sentences
+
+
+def iter_segments(lines):
+    for paragraph_index, paragraph in enumerate(iter_paragraphs(lines)):
+        for sentence in split_sentences(paragraph):
+            yield paragraph_index, sentence
+
+
+def translate_document(document, translate, batch_size=32, n_process=1,
+                       translations_file="../Data/preferential_translations.json", terminology=None, nlp_model=None):
+    # document is a string or any iterable of lines (e.g. an open file); translate takes a list of preprocessed
+    # sentences and returns their translations in order. Results are yielded per sentence as each batch finishes,
+    # so only one batch of token mappings is alive at a time.
+    if isinstance(document, str):
+        document = document.splitlines()
+    
+    pending = deque()
+    
+    def sentences():
+        for paragraph_index, sentence in iter_segments(document):
+            pending.append((paragraph_index, sentence))
+            yield sentence
+    
+    preprocessed = iter_preprocess_batch(sentences(), batch_size=batch_size, n_process=n_process,
+                                         translations_file=translations_file, terminology=terminology,
+                                         nlp_model=nlp_model)
+    while True:
+        batch = list(itertools.islice(preprocessed, batch_size))
+        if not batch:
+            return
+        
+        translations = list(translate([processed_text for processed_text, _ in batch]))
+        if len(translations) != len(batch):
+            # zip would drop the rest of the batch and leave pending out of step with later batches
+            raise ValueError(f"translate returned {len(translations)} translations for {len(batch)} sentences")
+        for (_, token_mapping), translated_text in zip(batch, translations):
+            paragraph_index, sentence = pending.popleft()
+            result_text, report = postprocess_translation_with_report(translated_text, token_mapping)
+            yield {
+                'paragraph': paragraph_index,
+                'source': sentence,
+                'translation': result_text,
+                'tokens_valid': report['valid']
+            }
@@ -0,0 +1,328 @@
+import threading
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, LogitsProcessor, LogitsProcessorList
+
+from finetune_replacements import MODELS
+from text_processing import TOKEN_PATTERN, postprocess_translation_with_report, preprocess_batch
+
+# replacement subsets tried after the full set of replacements, before falling back to the untouched source text
+REPLACEMENT_SUBSETS = [
+    ("without_nlp_places", ("nlp_places",)),
+    ("without_nlp_places_and_acronyms", ("nlp_places", "acronym")),
+]
+
+# generation stops at this many pieces per source piece (plus the slack), well short of max_new_tokens for short inputs
+MAX_OUTPUT_LENGTH_RATIO = 2.0
+MAX_OUTPUT_LENGTH_SLACK = 16
+
+
+def target_language_for(source_language):
+    return "en" if source_language == "fr" else "fr"
+
+
+def placeholder_sequences(tokenizer, placeholder):
+    # a placeholder after a space and one glued to punctuation, e.g. "(SITE0013)", split into different pieces
+    encodings = {tuple(tokenizer(text_target=placeholder, add_special_tokens=False)["input_ids"])}
+    prefix_ids = tokenizer(text_target="(", add_special_tokens=False)["input_ids"]
+    glued_ids = tokenizer(text_target="(" + placeholder, add_special_tokens=False)["input_ids"]
+    if glued_ids[:len(prefix_ids)] == prefix_ids and len(glued_ids) > len(prefix_ids):
+        encodings.add(tuple(glued_ids[len(prefix_ids):]))
+    
+    # a placeholder only counts as started once its pieces spell out the whole category word (SITE, TAXON, ...),
+    # so ordinary words that share a first piece are never forced into a placeholder
+    category = placeholder.rstrip("0123456789")
+    sequences = []
+    for sequence in encodings:
+        if not sequence:
+            continue
+        commit_length = next((k for k in range(1, len(sequence) + 1)
+                              if category in tokenizer.decode(list(sequence[:k])).strip()), len(sequence))
+        sequences.append((sequence, commit_length))
+    return sequences
+
+
+class PlaceholderLogitsProcessor(LogitsProcessor):
+    """Makes each placeholder in a row's token mapping come out exactly once, verbatim
+    
+    Once a placeholder has started, only the pieces that complete a placeholder not yet generated are allowed.
+    Completing a placeholder a second time is blocked, and so is ending the sequence while one is still missing.
+    When max_new_tokens is given and only just enough steps are left to write the missing placeholders, those
+    placeholders are forced, so a model that wants to drop one cannot run on to the length limit.
+    """
+    
+    def __init__(self, tokenizer, placeholders_per_row, eos_token_ids, sequence_cache=None, max_new_tokens=None):
+        self.eos_token_ids = [token_id for token_id in eos_token_ids if token_id is not None]
+        self.max_new_tokens = max_new_tokens
+        self._prompt_length = None
+        sequence_cache = {} if sequence_cache is None else sequence_cache
+        self.rows = []
+        for placeholders in placeholders_per_row:
+            sequences = []
+            for placeholder in placeholders:
+                if placeholder not in sequence_cache:
+                    sequence_cache[placeholder] = placeholder_sequences(tokenizer, placeholder)
+                sequences.extend((placeholder, sequence, commit_length)
+                                 for sequence, commit_length in sequence_cache[placeholder])
+            shortest = {}
+            for placeholder, sequence, _ in sequences:
+                shortest[placeholder] = min(shortest.get(placeholder, len(sequence)), len(sequence))
+            self.rows.append((list(placeholders), sequences, shortest))
+        
+        # counts of completed placeholders per generated prefix, carried from one step to the next
+        self._previous_counts = {}
+        self._current_counts = {}
+    
+    @staticmethod
+    def _ends_with(ids, sequence, end):
+        return end >= len(sequence) and tuple(ids[end - len(sequence):end]) == sequence
+    
+    def _emitted_counts(self, source_row, ids, sequences):
+        counts = self._previous_counts.get((source_row, tuple(ids[:-1])))
+        if counts is None:
+            counts = {}
+            ends = range(1, len(ids) + 1)
+        else:
+            counts = dict(counts)
+            ends = [len(ids)]  # beam search only ever appends one piece to a prefix seen on the last step
+        
+        for end in ends:
+            for placeholder, sequence, _ in sequences:
+                if self._ends_with(ids, sequence, end):
+                    counts[placeholder] = counts.get(placeholder, 0) + 1
+        
+        self._current_counts[(source_row, tuple(ids))] = counts
+        return counts
+    
+    def _forced_pieces(self, ids, sequences, shortest, missing):
+        # pieces that start (or continue) a missing placeholder, once the steps left only just cover writing them all
+        steps_left = self.max_new_tokens - (len(ids) - self._prompt_length)
+        if steps_left > sum(shortest[placeholder] for placeholder in missing) + 1:
+            return set()
+        
+        continuing = {sequence[k] for placeholder, sequence, _ in sequences if placeholder in missing
+                      for k in range(1, len(sequence)) if self._ends_with(ids, sequence[:k], len(ids))}
+        return continuing or {sequence[0] for placeholder, sequence, _ in sequences if placeholder in missing}
+    
+    def __call__(self, input_ids, scores):
+        self._previous_counts, self._current_counts = self._current_counts, {}
+        if self._prompt_length is None:
+            self._prompt_length = input_ids.shape[1]  # decoder start (and forced language) pieces
+        # rows are laid out input by input, each repeated once per beam or returned sequence
+        expansion = max(1, input_ids.shape[0] // max(1, len(self.rows)))
+        
+        for row in range(input_ids.shape[0]):
+            source_row = row // expansion
+            placeholders, sequences, shortest = self.rows[source_row]
+            if not sequences:
+                continue
+            
+            ids = input_ids[row].tolist()
+            counts = self._emitted_counts(source_row, ids, sequences)
+            allowed, banned = set(), set()
+            for placeholder, sequence, commit_length in sequences:
+                emitted = counts.get(placeholder, 0) > 0
+                for k in range(len(sequence)):
+                    if k and not self._ends_with(ids, sequence[:k], len(ids)):
+                        continue
+                    if emitted and k == len(sequence) - 1:
+                        banned.add(sequence[k])
+                    elif not emitted and k >= commit_length:
+                        allowed.add(sequence[k])
+            
+            missing = [placeholder for placeholder in placeholders if counts.get(placeholder, 0) == 0]
+            if missing and not allowed and self.max_new_tokens is not None:
+                allowed = self._forced_pieces(ids, sequences, shortest, missing)
+            
+            if allowed:
+                mask = torch.full_like(scores[row], float("-inf"))
+                mask[list(allowed)] = 0
+                scores[row] = scores[row] + mask
+            elif banned:
+                scores[row, list(banned)] = float("-inf")
+            
+            if missing:
+                scores[row, self.eos_token_ids] = float("-inf")
+        
+        return scores
+
+
+class TranslationModel:
+    """One merged seq2seq model from finetune_replacements.MODELS, loaded once and used for batched generation"""
+    
+    def __init__(self, which, model_dir=None, device=None, torch_dtype=torch.float32, num_beams=4,
+                 max_source_length=512, max_new_tokens=512, constrain_placeholders=True):
+        if which not in MODELS:
+            raise ValueError(f"Model '{which}' not found. Available models: {list(MODELS.keys())}")
+        
+        model_info = MODELS[which]
+        self.name = which
+        self.language_map = model_info["language_map"]
+        self.restrict_source_language = model_info.get("restrict_source_language")
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.num_beams = num_beams
+        self.max_source_length = max_source_length
+        self.max_new_tokens = max_new_tokens
+        self.constrain_placeholders = constrain_placeholders
+        self._placeholder_sequences = {}
+        
+        model_id = model_dir or model_info["model_id"]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True)
+        if getattr(self.tokenizer, "pad_token", None) is None and getattr(self.tokenizer, "eos_token", None):
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_id, torch_dtype=torch_dtype)
+        self.model.to(self.device)
+        self.model.eval()
+        self.model.config.use_cache = True
+        
+        # src_lang lives on the shared tokenizer, so generation calls are serialised per model
+        self._lock = threading.Lock()
+    
+    def supports(self, source_language):
+        return self.restrict_source_language is None or self.restrict_source_language == source_language
+    
+    def _generation_language_kwargs(self, source_language):
+        mapped_source = self.language_map[source_language]
+        mapped_target = self.language_map[target_language_for(source_language)]
+        
+        if self.name == "m2m100_418m":
+            self.tokenizer.src_lang = mapped_source
+            return {"forced_bos_token_id": self.tokenizer.get_lang_id(mapped_target)}
+        if self.name in ["mbart50_mmt_fr", "mbart50_mmt_en"]:
+            self.tokenizer.src_lang = mapped_source
+            return {"forced_bos_token_id": self.tokenizer.convert_tokens_to_ids(mapped_target)}
+        return {}
+    
+    def _eos_token_ids(self):
+        eos_token_id = self.model.generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = self.tokenizer.eos_token_id
+        return eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
+    
+    def generate(self, texts, source_language, token_mappings=None, **generation_kwargs):
+        if not texts:
+            return []
+        if not self.supports(source_language):
+            raise ValueError(f"Model '{self.name}' only translates from '{self.restrict_source_language}'")
+        
+        with self._lock:
+            language_kwargs = self._generation_language_kwargs(source_language)
+            encoded = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True,
+                                     max_length=self.max_source_length).to(self.device)
+            
+            # one long-running row holds up the whole batch, so the limit follows the longest input, not a constant
+            longest_input = int(encoded["attention_mask"].sum(dim=1).max())
+            max_new_tokens = generation_kwargs.pop(
+                "max_new_tokens",
+                min(self.max_new_tokens, int(longest_input * MAX_OUTPUT_LENGTH_RATIO) + MAX_OUTPUT_LENGTH_SLACK))
+            
+            kwargs = {"num_beams": self.num_beams, "max_new_tokens": max_new_tokens}
+            kwargs.update(language_kwargs)
+            if token_mappings is not None and self.constrain_placeholders:
+                processor = PlaceholderLogitsProcessor(self.tokenizer, [list(mapping) for mapping in token_mappings],
+                                                       self._eos_token_ids(), sequence_cache=self._placeholder_sequences,
+                                                       max_new_tokens=max_new_tokens)
+                kwargs["logits_processor"] = LogitsProcessorList([processor])
+            kwargs.update(generation_kwargs)
+            
+            with torch.inference_mode():
+                output_ids = self.model.generate(**encoded, **kwargs)
+            return self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+
+def load_translation_models(which_models=None, model_dirs=None, **model_kwargs):
+    model_dirs = model_dirs or {}
+    return {which: TranslationModel(which, model_dir=model_dirs.get(which), **model_kwargs)
+            for which in (which_models or MODELS.keys())}
+
+
+def build_candidate_variants(text, processed_text, token_mapping):
+    variants = [("all_replacements", processed_text, token_mapping)]
+    seen_token_sets = {frozenset(token_mapping)}
+    
+    for name, dropped_categories in REPLACEMENT_SUBSETS:
+        kept = {token: mapping for token, mapping in token_mapping.items()
+                if mapping['category'] not in dropped_categories}
+        if not kept or frozenset(kept) in seen_token_sets:
+            continue
+        seen_token_sets.add(frozenset(kept))
+        
+        # put the original wording back for the dropped tokens
+        restored_text = TOKEN_PATTERN.sub(
+            lambda match: token_mapping[match.group()]['original_text']
+            if match.group() in token_mapping and match.group() not in kept else match.group(),
+            processed_text)
+        variants.append((name, restored_text, kept))
+    
+    if token_mapping:
+        variants.append(("no_replacements", text, {}))
+    return variants
+
+
+def translate_with_retries(models, texts, source_language, num_return_sequences=2, terminology=None,
+                           preprocessed=None, memory=None):
+    # three passes, each over every model in turn and each only for the texts still unresolved: the full replacements
+    # (nearly always enough), then the smaller replacement subsets, and only then the text without replacements, so a
+    # fallback model that keeps the terminology is preferred over dropping it; within a pass, every candidate
+    # (variants x returned beams) goes into one generate call per model and the first that validates wins
+    if preprocessed is None:
+        preprocessed = preprocess_batch(texts, terminology=terminology)
+    direction = f"{source_language}-{target_language_for(source_language)}"
+    candidates = [build_candidate_variants(text, processed_text, token_mapping)
+                  for text, (processed_text, token_mapping) in zip(texts, preprocessed)]
+    passes = [[variants[:1],
+               [variant for variant in variants[1:] if variant[0] != "no_replacements"],
+               [variant for variant in variants[1:] if variant[0] == "no_replacements"]]
+              for variants in candidates]
+    models = [model for model in models if model.supports(source_language)]
+    results = [None] * len(texts)
+    pending = list(range(len(texts)))
+    
+    for stage in range(3):
+        for model in models:
+            if stage == 0 and memory is not None and pending:
+                found = memory.get_many(model.name, direction, [candidates[i][0][1] for i in pending])
+                for i in pending:
+                    name, variant_text, token_mapping = candidates[i][0]
+                    if variant_text in found:
+                        result_text, report = postprocess_translation_with_report(found[variant_text], token_mapping)
+                        if report['valid']:
+                            results[i] = {'translation': result_text, 'tokens_valid': True, 'model': model.name,
+                                          'variant': name}
+                # a best-effort result from an earlier model is still pending, so fallback models get their turn
+                pending = [i for i in pending if results[i] is None or not results[i]['tokens_valid']]
+            
+            flat = [(i, variant) for i in pending for variant in passes[i][stage]]
+            if not flat:
+                continue
+            outputs = model.generate([variant_text for _, (_, variant_text, _) in flat], source_language,
+                                     token_mappings=[token_mapping for _, (_, _, token_mapping) in flat],
+                                     num_beams=max(model.num_beams, num_return_sequences),
+                                     num_return_sequences=num_return_sequences)
+            
+            remembered = []
+            for position, (i, (name, variant_text, token_mapping)) in enumerate(flat):
+                if results[i] is not None and results[i]['tokens_valid']:
+                    continue
+                
+                beams = outputs[position * num_return_sequences:(position + 1) * num_return_sequences]
+                for rank, output in enumerate(beams):
+                    result_text, report = postprocess_translation_with_report(output, token_mapping)
+                    if rank == 0:
+                        # best effort if nothing validates: the top beam of the last variant tried
+                        results[i] = {'translation': result_text, 'tokens_valid': False, 'model': model.name,
+                                      'variant': name}
+                    if report['valid']:
+                        results[i] = {'translation': result_text, 'tokens_valid': True, 'model': model.name,
+                                      'variant': name}
+                        if name == "all_replacements":
+                            remembered.append((variant_text, output))
+                        break
+            
+            if memory is not None and remembered:
+                memory.put_many(model.name, direction, remembered)
+            pending = [i for i in pending if results[i] is None or not results[i]['tokens_valid']]
+        
+        if not pending:
+            break
+    
+    return results
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import time
+
+
+class TranslationMemory:
+    """SQLite store of model output keyed on (model name, direction, preprocessed text), evicting least recently used"""
+    
+    def __init__(self, db_path="../Data/translation_memory.sqlite", max_entries=1000000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                model_name TEXT NOT NULL,
+                direction TEXT NOT NULL,
+                source_text TEXT NOT NULL,
+                translated_text TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (model_name, direction, source_text)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        self.connection.commit()
+        self._entry_count = self._count_entries()
+    
+    def _count_entries(self):
+        return self.connection.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+    
+    def get_many(self, model_name, direction, texts):
+        found = {}
+        unique_texts = list(dict.fromkeys(texts))
+        with self._lock:
+            # stay well under SQLite's limit on bound parameters
+            for i in range(0, len(unique_texts), 500):
+                chunk = unique_texts[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT source_text, translated_text FROM translations "
+                    f"WHERE model_name = ? AND direction = ? AND source_text IN ({placeholders})",
+                    [model_name, direction, *chunk]).fetchall()
+                found.update(rows)
+            
+            if found:
+                now = time.time_ns()
+                self.connection.executemany(
+                    "UPDATE translations SET last_used = ? WHERE model_name = ? AND direction = ? AND source_text = ?",
+                    [(now, model_name, direction, text) for text in found])
+                self.connection.commit()
+            
+            self.hits += sum(1 for text in texts if text in found)
+            self.misses += sum(1 for text in texts if text not in found)
+        return found
+    
+    def get(self, model_name, direction, text):
+        return self.get_many(model_name, direction, [text]).get(text)
+    
+    def put_many(self, model_name, direction, pairs):
+        pairs = list(pairs)
+        if not pairs:
+            return
+        
+        with self._lock:
+            now = time.time_ns()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations (model_name, direction, source_text, translated_text, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(model_name, direction, source_text, translated_text, now) for source_text, translated_text in pairs])
+            
+            # the running count is an upper bound (replaced rows are counted again), so recount before evicting
+            self._entry_count += len(pairs)
+            if self._entry_count > self.max_entries:
+                self._entry_count = self._count_entries()
+                excess = self._entry_count - self.max_entries
+                if excess > 0:
+                    self.connection.execute(
+                        "DELETE FROM translations WHERE rowid IN "
+                        "(SELECT rowid FROM translations ORDER BY last_used LIMIT ?)", (excess,))
+                    self._entry_count -= excess
+            self.connection.commit()
+    
+    def put(self, model_name, direction, source_text, translated_text):
+        self.put_many(model_name, direction, [(source_text, translated_text)])
+    
+    def wrap(self, translate, model_name, direction):
+        # returns a batch translate callable (list of preprocessed texts -> list of translations) that only sends
+        # segments the memory has not seen to the model, e.g. for text_processing.translate_document
+        def translate_with_memory(texts):
+            found = self.get_many(model_name, direction, texts)
+            missing = [text for text in dict.fromkeys(texts) if text not in found]
+            if missing:
+                translated = translate(missing)
+                new_pairs = list(zip(missing, translated))
+                self.put_many(model_name, direction, new_pairs)
+                found.update(new_pairs)
+            return [found[text] for text in texts]
+        
+        return translate_with_memory
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._count_entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries
+        }
+    
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from text_processing import get_terminology_index, preprocess_batch
+from translation_inference import load_translation_models, translate_with_retries
+
+HOST = "127.0.0.1"
+PORT = 8008
+MAX_BATCH_SIZE = 32
+MAX_WAIT_MS = 20
+NUM_RETURN_SEQUENCES = 2
+DEFAULT_MODELS = {"en": "opus_mt_en_fr", "fr": "opus_mt_fr_en"}
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """Queues concurrent requests and runs them as one batch once it is full or the oldest request has waited max_wait_ms"""
+    
+    def __init__(self, process_batch, executor, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.batches = 0
+        self.items = 0
+        self._worker = None
+    
+    async def submit(self, item):
+        if self._worker is None:
+            self.queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+    
+    async def _collect_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # requests that arrive while a batch is generating are queued and picked up together next time round
+            batch = await self._collect_batch()
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+    
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'queued': self.queue.qsize() if self.queue is not None else 0
+        }
+
+
+class TranslationService:
+    """Wraps preprocessing, batched generation and postprocessing around the loaded models, one batcher per direction"""
+    
+    def __init__(self, models, default_models=None, fallback_models=None, terminology=None, memory=None,
+                 max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, num_return_sequences=NUM_RETURN_SEQUENCES):
+        self.models = models
+        self.default_models = default_models or DEFAULT_MODELS
+        self.fallback_models = fallback_models or {}  # source language -> models retried when nothing validates
+        self.num_return_sequences = num_return_sequences
+        self.terminology = terminology or get_terminology_index()
+        self.memory = memory
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(models)))
+        self.batchers = {}
+        
+        # spaCy and the place cache are shared by every model's worker thread
+        self._preprocess_lock = threading.Lock()
+    
+    def _batcher(self, which, source_language):
+        key = (which, source_language)
+        if key not in self.batchers:
+            retry_models = [self.models[which]] + [self.models[name] for name in
+                                                   self.fallback_models.get(source_language, []) if name != which]
+            process_batch = functools.partial(self._translate_batch, retry_models, source_language)
+            self.batchers[key] = MicroBatcher(process_batch, self.executor, max_batch_size=self.max_batch_size,
+                                              max_wait_ms=self.max_wait_ms)
+        return self.batchers[key]
+    
+    def _translate_batch(self, models, source_language, texts):
+        with self._preprocess_lock:
+            preprocessed = preprocess_batch(texts, batch_size=len(texts), terminology=self.terminology)
+        
+        return translate_with_retries(models, texts, source_language, num_return_sequences=self.num_return_sequences,
+                                      preprocessed=preprocessed, memory=self.memory)
+    
+    async def translate(self, text, source_language, model=None):
+        # checked here, before queueing: a bad request inside a micro-batch would fail every request batched with it
+        if not isinstance(text, str):
+            raise ValueError(f"'text' must be a string, got {type(text).__name__}")
+        if model is not None and not isinstance(model, str):
+            raise ValueError(f"'model' must be a string, got {type(model).__name__}")
+        if source_language not in ("en", "fr"):
+            raise ValueError(f"source_lang must be 'en' or 'fr', got '{source_language}'")
+        which = model or self.default_models[source_language]
+        if which not in self.models:
+            raise ValueError(f"Model '{which}' is not loaded. Loaded models: {list(self.models.keys())}")
+        if not self.models[which].supports(source_language):
+            raise ValueError(f"Model '{which}' does not translate from '{source_language}'")
+        
+        return await self._batcher(which, source_language).submit(text)
+    
+    async def translate_many(self, texts, source_language, model=None):
+        # submitted together, so they land in the same batch as any other concurrent requests
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise ValueError("'texts' must be a list of strings")
+        return await asyncio.gather(*(self.translate(text, source_language, model) for text in texts))
+    
+    def stats(self):
+        return {f"{which}:{source_language}": batcher.stats()
+                for (which, source_language), batcher in self.batchers.items()}
+
+
+async def _route(service, method, path, body):
+    if method == "GET" and path == "/stats":
+        return 200, service.stats()
+    if method != "POST" or path != "/translate":
+        return 404, {'error': f"no route for {method} {path}"}
+    
+    request = json.loads(body or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("request body must be a JSON object")
+    source_language = request.get("source_lang")
+    model = request.get("model")
+    if "texts" in request:
+        return 200, {'results': await service.translate_many(request["texts"], source_language, model)}
+    if "text" in request:
+        return 200, await service.translate(request["text"], source_language, model)
+    raise ValueError("request body needs 'text' or 'texts'")
+
+
+async def _handle_connection(service, reader, writer):
+    try:
+        request_line = (await reader.readline()).decode("latin-1")
+        method, path, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        status, payload = await _route(service, method, path, body)
+    except ValueError as e:
+        status, payload = 400, {'error': str(e)}
+    except Exception as e:
+        status, payload = 500, {'error': str(e)}
+    
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                 f"Content-Type: application/json; charset=utf-8\r\n"
+                 f"Content-Length: {len(data)}\r\n"
+                 f"Connection: close\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+    writer.close()
+
+
+async def serve(service, host=HOST, port=PORT):
+    server = await asyncio.start_server(functools.partial(_handle_connection, service), host, port)
+    print(f"Serving translations on http://{host}:{port} (POST /translate, GET /stats)")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    print("Loading models...")
+    models = load_translation_models()
+    service = TranslationService(models)
+    asyncio.run(serve(service))
+
+
+if __name__ == "__main__":
+    main()